@@ -1,7 +1,5 @@
-
-
 from pythonmlp.mlp import *
-
-
-
-
+from pythonmlp.history import *
+from pythonmlp.bank import *
+from pythonmlp.triallog import *
+from pythonmlp.speculate import *
@@ -0,0 +1,187 @@
+"""
+
+Re-analysing archived sessions in bulk.
+
+This finds all session files in a directory, both in the legacy format
+(space separated, as written by legacy/fileoutput.py) and in the CSV
+format written by TrialLog (as in tests/anisochrony-gui.py). Each file
+is read into columnar arrays and its likelihood is replayed in one
+vectorised pass (see MLP.from_history). The files are spread over a
+pool of processes, and the result is one table with a row per session.
+
+From the command line:
+
+    python -m pythonmlp.analysis data/ --slope .1 --hyp-min 0 --hyp-max 200 \\
+           --hyp-n 200 --fa 0 .1 .2 .3 .4 --out summary.csv
+
+"""
+#
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from pythonmlp.mlp import MLP
+from pythonmlp.triallog import read_trials
+
+
+
+
+def find_sessions(directory):
+    """
+    Return the session files in a directory (and its subdirectories), sorted:
+    the CSV files and the legacy .txt files (but not their .metadata.txt files).
+    """
+    found = []
+    for root,_,files in os.walk(directory):
+        for f in files:
+            if f.endswith(".csv") or (f.endswith(".txt") and not f.endswith(".metadata.txt")):
+                found.append(os.path.join(root,f))
+    return sorted(found)
+
+
+
+
+def read_session(fname):
+    """
+    Read a session file, in either format, into a dict of arrays with one
+    element per trial: trial, kind ("mlp" or "catch"), stimulus and response
+    (a boolean), and also participant.
+    In the CSV format, the participant is taken from the participant column
+    if there is one, or else from the file name (up to the first "-").
+    """
+    with open(fname,'r',encoding='utf-8') as f:
+        header = f.readline()
+
+    if "," in header:
+        trials = list(read_trials(fname))
+        participant = os.path.basename(fname).split("-")[0]
+        cols = {
+            "participant" : [ str(t.get("participant",participant)) for t in trials ],
+            "trial"       : [ t["trial"] for t in trials ],
+            "kind"        : [ str(t.get("kind","mlp")) for t in trials ],
+            "stimulus"    : [ t["stimulus"] for t in trials ],
+            "response"    : [ bool(t["response"]) for t in trials ],
+        }
+    else:
+        # The legacy format: PARTICIPANT TRIAL TYPE STIMULUS RESPONSE
+        rows = []
+        with open(fname,'r',encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                if len(fields)==5:
+                    rows.append(fields)
+        cols = {
+            "participant" : [ r[0] for r in rows ],
+            "trial"       : [ int(r[1]) for r in rows ],
+            "kind"        : [ r[2] for r in rows ],
+            "stimulus"    : [ float(r[3]) for r in rows ],
+            "response"    : [ int(r[4])==1 for r in rows ],
+        }
+
+    return {
+        "participant" : np.array(cols["participant"],dtype=str),
+        "trial"       : np.array(cols["trial"],dtype=int),
+        "kind"        : np.array(cols["kind"],dtype=str),
+        "stimulus"    : np.array(cols["stimulus"],dtype=float),
+        "response"    : np.array(cols["response"],dtype=bool),
+    }
+
+
+
+
+def analyse_session(fname, credible=.95, **kwargs):
+    """
+    Replay one session file and summarise it in a table row (a dict).
+    The keyword arguments are passed on to the MLP constructor.
+    """
+    tab = read_session(fname)
+    mlp = MLP.from_history( tab["stimulus"], tab["response"], kinds=tab["kind"], **kwargs )
+
+    row = {
+        "file"        : fname,
+        "participant" : tab["participant"][0] if len(tab["participant"]) else "",
+        "n_trials"    : len(tab["trial"]),
+        "n_catch"     : int(np.sum(tab["kind"]=="catch")),
+        "prop_yes"    : np.mean(tab["response"]) if len(tab["response"]) else np.nan,
+        "catch_yes"   : np.mean(tab["response"][tab["kind"]=="catch"]) if np.any(tab["kind"]=="catch") else np.nan,
+        "midpoint_estimate" : mlp.get_midpoint_estimate(),
+    }
+
+    summary = mlp.get_posterior_summary(credible=credible)
+    for name in ["midpoint","fa","slope"]:
+        if name+"_mean" not in summary:
+            continue
+        row[name+"_mean"] = summary[name+"_mean"]
+        row[name+"_map"]  = summary[name+"_map"]
+        row[name+"_lo"],row[name+"_hi"] = summary[name+"_ci"]
+    row["entropy"] = summary["entropy"]
+    return row
+
+
+
+
+def _analyse_job(job):
+    (fname,credible,kwargs) = job
+    try:
+        return analyse_session(fname,credible=credible,**kwargs)
+    except Exception as e:
+        print("Error analysing {}: {}".format(fname,e))
+        return None
+
+
+
+
+def analyse_directory(directory, max_workers=None, credible=.95, out=None, **kwargs):
+    """
+    Re-analyse all session files in a directory (see find_sessions) and
+    return a pandas data frame with one row per session.
+    The keyword arguments describe the hypotheses, as for MLP
+    (slope, hyp_min, hyp_max, hyp_n, fa, ...); log mode is the default here.
+    max_workers : the number of processes (by default, one per CPU);
+                  with 0, the files are analysed one by one in this process
+    If out is given, the table is also written to that CSV file.
+    Files that cannot be analysed are reported and left out.
+    """
+    import pandas as pd
+
+    kwargs.setdefault("log",True)
+    jobs = [ (fname,credible,kwargs) for fname in find_sessions(directory) ]
+
+    if max_workers==0:
+        rows = [ _analyse_job(job) for job in jobs ]
+    else:
+        workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Hand out the files in chunks, as each one is quick to analyse
+            rows = list(pool.map(_analyse_job,jobs,chunksize=max(1,len(jobs)//(4*workers))))
+
+    table = pd.DataFrame([ row for row in rows if row is not None ])
+    if out is not None:
+        table.to_csv(out,index=False)
+    return table
+
+
+
+
+if __name__=="__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-analyse a directory of MLP session files")
+    parser.add_argument("directory")
+    parser.add_argument("--slope",   type=float, nargs="+", required=True,
+                        help="the slope, or several candidate slopes")
+    parser.add_argument("--hyp-min", type=float, required=True)
+    parser.add_argument("--hyp-max", type=float, required=True)
+    parser.add_argument("--hyp-n",   type=int,   required=True)
+    parser.add_argument("--fa",      type=float, nargs="+", required=True)
+    parser.add_argument("--workers", type=int,   default=None)
+    parser.add_argument("--out",     default=None, help="CSV file to write the table to")
+    args = parser.parse_args()
+
+    table = analyse_directory( args.directory, max_workers=args.workers, out=args.out,
+                               slope=args.slope[0] if len(args.slope)==1 else args.slope,
+                               hyp_min=args.hyp_min, hyp_max=args.hyp_max,
+                               hyp_n=args.hyp_n, fa=args.fa )
+    if args.out is None:
+        print(table.to_string())
@@ -0,0 +1,224 @@
+"""
+
+Running many MLP sessions side by side.
+
+All sessions in a bank share one hypothesis grid configuration
+(slope, midpoints and false alarm rates), so their likelihoods can be
+stacked into one (sessions x false alarm rate x midpoint) array and
+advanced together, one trial at a time. With candidate slopes, the
+array is (sessions x slope x false alarm rate x midpoint).
+
+"""
+#
+import copy
+import numpy as np
+
+from pythonmlp.mlp import MLP, pyes, logpyes, posterior_summary
+from pythonmlp.history import TrialHistory
+
+
+
+
+class MLPBank:
+    """
+    A stack of MLP sessions that share one hypothesis grid.
+    Each call to update() takes one stimulus and one response per session,
+    and each call to next_stimulus() returns one stimulus per session.
+    Individual sessions can be looked at as MLP objects through session(i).
+    """
+
+
+
+    def __init__(
+            self,
+
+            # The number of sessions
+            n,
+
+            # The remaining arguments are as for MLP
+            slope,
+            hyp_min,
+            hyp_max,
+            hyp_n,
+            fa,
+            log = False,
+            renorm_every = 20,
+            tol = 0.,
+
+            # Seed for choosing between equally likely hypotheses
+            seed = None,
+    ):
+
+        self.n = n
+
+        # One template MLP object holds the grid configuration shared by all sessions
+        self.template = MLP(slope=slope,hyp_min=hyp_min,hyp_max=hyp_max,hyp_n=hyp_n,fa=fa,
+                            log=log,renorm_every=renorm_every,tol=tol)
+
+        # The likelihoods of all sessions, indexed by (session, false alarm rate, midpoint)
+        self.grid = np.repeat( self.template.grid[None], n, axis=0 )
+
+        # The history, one array of stimuli and one of responses per trial
+        self.stimuli   = []
+        self.responses = []
+
+        self.rng = np.random.default_rng(seed)
+        self._since_renorm = 0
+
+
+
+
+    def __len__(self):
+        return self.n
+
+
+
+    def __getitem__(self, i):
+        return self.session(i)
+
+
+
+    def session(self, i):
+        """
+        Return session i as an MLP object. Its likelihood grid is a view
+        into the bank, but its history and estimates are those at the time
+        this is called (call refresh() on it to catch up with the grid).
+        Further trials should be given to the bank, not to the session.
+        """
+        mlp = copy.copy(self.template)
+        mlp.grid = self.grid[i]
+        mlp.history = TrialHistory.from_arrays( [ x[i] for x in self.stimuli ],
+                                                [ r[i] for r in self.responses ] )
+        mlp._since_renorm = self._since_renorm
+        mlp.refresh()
+        return mlp
+
+
+
+
+    def update(self, stimuli, responses):
+        """
+        Given one answer (yes=True or no=False) per session to the
+        stimuli presented in that session, update the likelihoods
+        of all sessions at once.
+        """
+        x    = np.asarray(stimuli,dtype=float).reshape(self.n)
+        resp = np.asarray(responses,dtype=bool).reshape(self.n)
+
+        self.stimuli.append(x)
+        self.responses.append(resp)
+
+        # The stimulus gets a session axis, followed by the axes of the grid
+        tpl = self.template
+        xs = x.reshape((self.n,)+(1,)*tpl.grid.ndim)
+        if tpl.log:
+            # Only evaluate the answer that was actually given in each session
+            lyes,_ = logpyes( xs[resp], tpl._a, tpl._m, tpl._k, no=False )
+            _,lno  = logpyes( xs[~resp], tpl._a, tpl._m, tpl._k, yes=False )
+            self.grid[resp]  += lyes
+            self.grid[~resp] += lno
+
+            self._since_renorm += 1
+            if tpl.renorm_every and self._since_renorm>=tpl.renorm_every:
+                self.renormalise()
+        else:
+            obsp = pyes( xs, tpl._a, tpl._m, tpl._k )
+            self.grid *= np.where( resp.reshape(xs.shape), obsp, 1-obsp )
+
+
+
+    def renormalise(self):
+        """ In log mode, subtract each session's maximum log-likelihood. """
+        if self.template.log:
+            self.grid -= self._session_max()
+        self._since_renorm = 0
+
+
+
+    def _session_max(self):
+        return self.grid.reshape(self.n,-1).max(axis=1).reshape((self.n,)+(1,)*(self.grid.ndim-1))
+
+
+
+
+    def get_max_like_mask(self):
+        """ Return a boolean array (shaped like the bank's grid) that is True
+        for the hypotheses that are maximally likely within their session. """
+        tpl = self.template
+        maxp = self._session_max()
+        if tpl.log:
+            return self.grid>=maxp-tpl.tol
+        if tpl.tol:
+            return self.grid>=maxp*np.exp(-tpl.tol)
+        return self.grid==maxp
+
+
+
+    def get_ml(self):
+        """
+        Choose one maximally likely hypothesis per session (at random if there
+        are several) and return its false alarm rate, midpoint and slope,
+        as three arrays with one element per session.
+        """
+        mask = self.get_max_like_mask().reshape(self.n,-1)
+
+        # Draw which of the tied hypotheses to take in each session,
+        # and then find it by counting through the ties
+        # (only needed in the sessions that actually have ties)
+        nties = mask.sum(axis=1)
+        pick  = np.floor(self.rng.random(self.n)*nties).astype(int)
+        i = np.argmax( mask, axis=1 )
+        tied = nties>1
+        if np.any(tied):
+            i[tied] = np.argmax( np.cumsum(mask[tied],axis=1)>pick[tied,None], axis=1 )
+
+        tpl = self.template
+        idx = np.unravel_index(i,tpl.grid.shape)
+        a = np.asarray(tpl.fa,dtype=float)[idx[-2]]
+        m = tpl.midpoints[idx[-1]]
+        if tpl.slopes is None:
+            k = np.full(self.n,float(tpl.slope))
+        else:
+            k = tpl.slopes[idx[0]]
+        return a,m,k
+
+
+
+
+    def next_stimulus(self):
+        """ Decide which stimulus level to present next in each session.
+        This is the sweet point of a maximum likelihood curve, as in MLP.
+        Sessions for which the sweet point does not exist get nan. """
+
+        a,m,k = self.get_ml()
+        p = self.template.calculate_target()
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            y = ((1-a)/(p-a))-1
+            stim = (np.log(y)/(-k))+m
+        stim[p<=a] = np.nan
+        return stim
+
+
+
+
+    def get_midpoint_estimate(self):
+        """ Return the current best estimate of the psychometric curve midpoint
+        in each session (the average over maximally likely hypotheses). """
+        mask = self.get_max_like_mask()
+        m = np.broadcast_to(self.template._m,self.template.grid.shape)
+        return (mask*m).reshape(self.n,-1).sum(axis=1)/mask.reshape(self.n,-1).sum(axis=1)
+
+
+
+    def get_posterior_summary(self, credible=.95):
+        """ Summarise the posterior of every session at once (see posterior_summary);
+        each entry gets a leading session axis. """
+        tpl = self.template
+        if tpl.log:
+            loglik = self.grid
+        else:
+            with np.errstate(divide='ignore'):
+                loglik = np.log(self.grid)
+        return posterior_summary( loglik, tpl.midpoints, tpl.fa, tpl.slopes, credible=credible )
+
@@ -0,0 +1,204 @@
+"""
+
+The history of trials in an MLP session.
+
+The trials are kept in typed arrays (one per column) that grow by
+doubling, so that adding a trial is cheap and the whole history is
+always available as contiguous arrays, without building them from
+a list first.
+
+"""
+#
+import numpy as np
+
+
+
+
+class TrialHistory:
+    """
+    A growable, columnar record of trials: the stimulus (float), the response
+    (bool) and optionally the kind of trial (e.g. "mlp" or "catch") and a
+    timestamp. It also keeps running counts for summary statistics.
+
+    It behaves like the list of {"stimulus":..., "response":...} dicts that
+    MLP.history used to be: len(), indexing and iteration give such dicts.
+    For whole-history work, use the column properties (stimulus, response,
+    kind, timestamp), which are read-only views rather than copies.
+    """
+
+    def __init__(self, capacity=64):
+        if capacity<1:
+            raise ValueError("The capacity of a history must be at least 1, not {}".format(capacity))
+        self._n = 0
+        self._stimulus  = np.empty(capacity,dtype=float)
+        self._response  = np.empty(capacity,dtype=bool)
+        self._kind      = np.empty(capacity,dtype=object) # (strings of any length)
+        self._timestamp = np.empty(capacity,dtype=float)
+
+        # Running counts
+        self.n_yes = 0
+
+
+
+    @classmethod
+    def from_arrays(cls, stimuli, responses, kinds=None, timestamps=None):
+        """ Make a history from arrays with one element per trial. """
+        hist = cls(capacity=max(64,len(stimuli)))
+        hist.extend(stimuli,responses,kinds,timestamps)
+        return hist
+
+
+
+    def copy(self):
+        """ Return an independent copy of the history. """
+        hist = TrialHistory(capacity=len(self._stimulus))
+        for name in ["_stimulus","_response","_kind","_timestamp"]:
+            getattr(hist,name)[:self._n] = getattr(self,name)[:self._n]
+        hist._n = self._n
+        hist.n_yes = self.n_yes
+        return hist
+
+
+
+    def stamp(self, timestamp, i=-1):
+        """ Set the timestamp of trial i (by default, the last one). """
+        if i<0:
+            i += self._n
+        if not 0<=i<self._n:
+            raise IndexError("trial index out of range")
+        self._timestamp[i] = np.nan if timestamp is None else timestamp
+
+
+
+    def _reserve(self, n):
+        # Make room for n trials, doubling the capacity as needed
+        capacity = len(self._stimulus)
+        if n<=capacity:
+            return
+        capacity = max(capacity,1)
+        while capacity<n:
+            capacity *= 2
+        for name in ["_stimulus","_response","_kind","_timestamp"]:
+            old = getattr(self,name)
+            new = np.empty(capacity,dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self,name,new)
+
+
+
+    def append(self, stimulus, response=None, kind="", timestamp=np.nan):
+        """
+        Add one trial. For compatibility, the trial can also be given as one
+        dict with "stimulus" and "response" (and optionally "kind" and "timestamp").
+        """
+        if isinstance(stimulus,dict):
+            trial = stimulus
+            stimulus,response = trial["stimulus"],trial["response"]
+            kind      = trial.get("kind",kind)
+            timestamp = trial.get("timestamp",timestamp)
+
+        self._reserve(self._n+1)
+        i = self._n
+        self._stimulus[i]  = stimulus
+        self._response[i]  = response
+        self._kind[i]      = "" if kind is None else kind
+        self._timestamp[i] = np.nan if timestamp is None else timestamp
+        self._n += 1
+        self.n_yes += bool(response)
+
+
+
+    def extend(self, stimuli, responses=None, kinds=None, timestamps=None):
+        """
+        Add a series of trials, given as arrays with one element per trial
+        (or, for compatibility, as one list of dicts).
+        """
+        if responses is None:
+            for trial in stimuli:
+                self.append(trial)
+            return
+
+        stimuli   = np.asarray(stimuli,dtype=float).ravel()
+        responses = np.asarray(responses,dtype=bool).ravel()
+        n = len(stimuli)
+        if len(responses)!=n:
+            raise ValueError("Got {} stimuli but {} responses".format(n,len(responses)))
+
+        self._reserve(self._n+n)
+        new = slice(self._n,self._n+n)
+        self._stimulus[new]  = stimuli
+        self._response[new]  = responses
+        self._kind[new]      = "" if kinds is None else kinds
+        self._timestamp[new] = np.nan if timestamps is None else timestamps
+        self._n += n
+        self.n_yes += int(np.count_nonzero(responses))
+
+
+
+    def _view(self, column):
+        v = column[:self._n]
+        v.flags.writeable = False
+        return v
+
+    @property
+    def stimulus(self):
+        return self._view(self._stimulus)
+
+    @property
+    def response(self):
+        return self._view(self._response)
+
+    @property
+    def kind(self):
+        return self._view(self._kind)
+
+    @property
+    def timestamp(self):
+        return self._view(self._timestamp)
+
+
+
+    def prop_yes(self):
+        """ The proportion of "yes" responses (nan if there are no trials yet). """
+        return self.n_yes/self._n if self._n else np.nan
+
+
+
+    def __len__(self):
+        return self._n
+
+
+
+    def __getitem__(self, i):
+        if isinstance(i,slice):
+            return [ self[j] for j in range(*i.indices(self._n)) ]
+        if i<0:
+            i += self._n
+        if not 0<=i<self._n:
+            raise IndexError("trial index out of range")
+        trial = {"stimulus":float(self._stimulus[i]),"response":bool(self._response[i])}
+        if self._kind[i]:
+            trial["kind"] = str(self._kind[i])
+        if not np.isnan(self._timestamp[i]):
+            trial["timestamp"] = float(self._timestamp[i])
+        return trial
+
+
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+
+
+    def to_dataframe(self):
+        """ Return the history as a pandas data frame, one row per trial. """
+        import pandas as pd
+
+        return pd.DataFrame({
+            "trial"     : np.arange(1,self._n+1),
+            "kind"      : self.kind,
+            "stimulus"  : self.stimulus,
+            "response"  : self.response,
+            "timestamp" : self.timestamp,
+        })
@@ -9,6 +9,12 @@ bias in estimating false alarm rate (e.g. Leek et al (2000 JASA)).
 #
 import numpy as np
 import random
+import copy
+import json
+import os
+from collections import OrderedDict
+
+from pythonmlp.history import TrialHistory
 
 
 
@@ -29,6 +35,184 @@ def pyes( x, a, m, k ):
 
 
 
+def _softplus( z ):
+    # log(1+exp(z)), as np.logaddexp(0,z) but several times faster
+    # (it agrees to within a rounding error)
+    return np.maximum(z,0.)+np.log1p(np.exp(-np.abs(z)))
+
+
+
+
+def logpyes( x, a, m, k, yes=True, no=True ):
+    """
+    Return the log probabilities of a "yes" and a "no" response
+    under the same psychometric function as pyes().
+    These are computed in the log domain throughout, so that
+    they do not round to log(0) when the curve saturates.
+    Pass yes=False or no=False to skip one of the two (it is then None).
+    """
+    lyes,lno = None,None
+    a = np.asarray(a,dtype=float)
+    with np.errstate(divide='ignore',over='ignore'):
+        z = k*(x-m)
+        if yes:
+            # log( a+(1-a)/(1+exp(-z)) ), in place, as this is the full size of the grid
+            lyes = np.asarray(np.divide( 1-a, 1+np.exp(-z) ))
+            lyes += a
+            np.log(lyes,out=lyes)
+            # Without false alarms the logistic itself can underflow,
+            # so there we take its log directly
+            if np.any(a==0):
+                np.copyto( lyes, -_softplus(-z), where=(a==0) )
+            lyes = lyes[()] # (a scalar rather than a 0-d array, if that is what we got)
+        if no:
+            lno  = np.log1p(-a)-_softplus(z)
+    return lyes,lno
+
+
+
+
+# The largest (trials x hypotheses) block we evaluate at once when replaying a history
+REPLAY_BLOCK = 2**17
+
+def history_likelihood( stimuli, responses, a, m, k, log=True ):
+    """
+    Return the (log-)likelihood of a whole history of answers
+    under each hypothesis. The stimuli and responses are arrays
+    with one element per trial, while a, m and k broadcast against
+    each other to give the shape of the hypothesis grid.
+    The (trials x hypotheses) array of observation probabilities
+    is reduced over trials in blocks, to keep the memory bounded.
+    """
+    stimuli   = np.asarray(stimuli,dtype=float).ravel()
+    responses = np.asarray(responses,dtype=bool).ravel()
+    if len(stimuli)!=len(responses):
+        raise ValueError("Got {} stimuli but {} responses".format(len(stimuli),len(responses)))
+
+    a = np.asarray(a,dtype=float)
+    shape = np.broadcast(a,m,k).shape
+    block = max(1,REPLAY_BLOCK//max(1,int(np.prod(shape))))
+    trialaxis = (-1,)+(1,)*len(shape)
+
+    # The order of the trials does not matter for the result, so we do
+    # all the "no" answers and then all the "yes" answers.
+    # The probability of a "no" is (1-a)(1-logistic(x-m)), so over the "no"
+    # answers the false alarm rate factors out and we only need to evaluate
+    # the logistic along the other axes of the grid.
+    xno  = stimuli[~responses].reshape(trialaxis)
+    xyes = stimuli[ responses].reshape(trialaxis)
+    with np.errstate(divide='ignore'):
+        if log:
+            total = len(xno)*np.log1p(-a)
+        else:
+            total = (1-a)**len(xno)
+    total = total+np.zeros(shape)
+
+    for i in range(0,len(xno),block):
+        z = k*(xno[i:i+block]-m)
+        if log:
+            total += -np.logaddexp(0,z).sum(axis=0)
+        else:
+            total *= (1-(1/(1+np.exp(-z)))).prod(axis=0)
+
+    if not log:
+        for i in range(0,len(xyes),block):
+            total *= pyes( xyes[i:i+block], a, m, k ).prod(axis=0)
+        return total
+
+    # The probability of a "yes" is at least the false alarm rate, so we
+    # can multiply that many of them together before taking a single log
+    # without underflowing. Where the false alarm rate is zero, we instead
+    # sum the log of the logistic (which only varies along the other axes).
+    apos = a[a>0]
+    yblock = block
+    if len(apos):
+        yblock = max(1,min(block,int(600/-np.log(min(apos.min(),.5)))))
+    for i in range(0,len(xyes),yblock):
+        z = k*(xyes[i:i+yblock]-m)
+        with np.errstate(divide='ignore',over='ignore'):
+            lyes = np.log( (a+(1-a)/(1+np.exp(-z))).prod(axis=0) )
+        if np.any(a==0):
+            lyes = np.where( a==0, -np.logaddexp(0,-z).sum(axis=0), lyes )
+        total += lyes
+
+    return total
+
+
+
+
+def posterior_summary( loglik, midpoints, fa, slopes=None, credible=.95 ):
+    """
+    Summarise the posterior (with a flat prior) given a log-likelihood grid indexed
+    by (false alarm rate, midpoint), or (slope, false alarm rate, midpoint) if
+    slopes are given. Any leading axes (such as the sessions of an MLPBank) are
+    kept, so that many grids are summarised at once. Returns a dict with:
+     midpoint_marginal, fa_marginal (and slope_marginal) : the marginal posteriors
+     midpoint_mean, midpoint_map, midpoint_ci : the posterior mean, the mode of the
+          marginal posterior and the equal-tailed credible interval (lower, upper)
+          (and the same for fa and slope)
+     map : the parameters (fa, midpoint[, slope]) of the most probable hypothesis
+     entropy : the entropy of the posterior over the whole grid, in nats
+    """
+    loglik = np.asarray(loglik,dtype=float)
+    params = [ ("fa",np.asarray(fa,dtype=float)), ("midpoint",np.asarray(midpoints,dtype=float)) ]
+    if slopes is not None:
+        params.insert(0,("slope",np.asarray(slopes,dtype=float)))
+    axes = tuple(range(-len(params),0))
+    lead = loglik.shape[:-len(params)]
+
+    # Normalise with the log-sum-exp trick
+    lp = loglik-loglik.max(axis=axes,keepdims=True)
+    post = np.exp(lp)
+    total = post.sum(axis=axes,keepdims=True)
+    post /= total
+    lp -= np.log(total)
+
+    summary = {"entropy":-_xlogx(post,lp).sum(axis=axes)}
+
+    best = np.unravel_index( np.argmax(post.reshape(lead+(-1,)),axis=-1), post.shape[-len(params):] )
+    summary["map"] = tuple( values[best[i]] for i,(_,values) in enumerate(params) )
+
+    tails = np.array([(1-credible)/2,1-(1-credible)/2])
+    for i,(name,values) in enumerate(params):
+        marginal = post.sum(axis=tuple( ax for ax in axes if ax!=axes[i] ))
+        cdf = np.cumsum(marginal,axis=-1)
+        # (the last value of the cdf can fall a rounding error short of one)
+        reach = cdf[...,None,:]>=np.minimum(tails[:,None],cdf[...,None,-1:])
+        summary[name+"_marginal"] = marginal
+        summary[name+"_mean"] = marginal@values
+        summary[name+"_map"]  = values[np.argmax(marginal,axis=-1)]
+        summary[name+"_ci"]   = values[np.argmax(reach,axis=-1)]
+
+    return summary
+
+
+
+
+# In the log-likelihood heat map (see MLP.plot_hypotheses), the colour scale goes
+# down to this far below the maximum
+HEATMAP_LOG_FLOOR = 20.
+
+# Hypotheses this far below the maximum log-likelihood are ignored when
+# computing the expected information gain (their posterior is below 1e-13)
+INFOGAIN_CUTOFF = 30.
+
+# When computing the expected information gain, the candidates are done in blocks
+# of at most this many (candidate x slope/midpoint) values
+INFOGAIN_BLOCK = 2**18
+
+# By default, the candidates for the information gain are the midpoints, or if
+# there are more than this many, this many evenly spaced levels across them
+INFOGAIN_N_CANDIDATES = 201
+
+def _xlogx( x, logx ):
+    # x*log(x), taking 0*log(0) to be 0
+    with np.errstate(invalid='ignore'):
+        return np.where( x>0, x*logx, 0. )
+
+
+
+
 # Ok, some quantities we can already calculate on the basis of what we have now
 # For example, the target P can be computed, given that we assume no attentional
 # lapses (Green 1993 JASA, eq. 6)
@@ -53,21 +237,27 @@ class MLP:
     def print(self):
 
         print("--- MLP object ---")
-        print("Psychometric curve slope : {}".format(self.slope))
-        print("# of hypotheses: {}".format(len(self.hypotheses)))
-        print("     {} midpoints between {:.3f} and {:.3f}".format(self.hyp_n,self.hyp_min,self.hyp_max))
+        if self.slopes is None:
+            print("Psychometric curve slope : {}".format(self.slope))
+        else:
+            print("Psychometric curve slopes : {}".format(", ".join([ str(k) for k in self.slopes ])))
+        print("# of hypotheses: {}".format(self._grid.size))
+        if self._active is not None:
+            print("     of which {} still in play (pruning at {})".format(len(self._active),self.prune))
+        print("     {} midpoints between {:.3f} and {:.3f}".format(len(self.midpoints),self.midpoints[0],self.midpoints[-1]))
         print("     false alarm rates : {}".format(", ".join([ str(f) for f in self.fa])))
         print("")
 
         print("History: {} answer(s)".format(len(self.history)))
         if len(self.history):
-            prop_yes = np.mean([ x['response'] for x in self.history])
-            print("     prop. yes response = {:.3f}".format(prop_yes))
-        
-        opts = self.get_max_like()
-        a_s, m_s, _ = zip(*opts)
-        print("# Maximum likelihood curves: {}".format(len(opts)))
+            print("     prop. yes response = {:.3f}".format(self.history.prop_yes()))
+
+        # The maximum likelihood curves are kept up to date by update()
+        a_s,m_s,k_s = self.get_max_like_params()
+        print("# Maximum likelihood curves: {}".format(len(m_s)))
         print("    Midpoints {:.3f} - {:.3f}, FA rates {} - {}".format(min(m_s),max(m_s),min(a_s),max(a_s)))
+        if self.slopes is not None:
+            print("    Slopes {} - {}".format(min(k_s),max(k_s)))
         print("    Midpoint estimate : {:.3f}".format(self.get_midpoint_estimate()))
         print("")
               
@@ -78,8 +268,9 @@ class MLP:
     def __init__(
             self,
 
-            # The slope of our psychometric curves
-            slope, # e.g. = .1,
+            # The slope of our psychometric curves, or a list of candidate
+            # slopes (which are then estimated along with the other parameters)
+            slope, # e.g. = .1, or [.025,.05,.1,.2,.4]
             
             # The minimum and maximum of the hypothesised thresholds
             hyp_min, # e.g. = 0,
@@ -90,6 +281,66 @@ class MLP:
             
             # Our false alarm rates (these will be crossed with the threshold hypotheses)
             fa, # e.g. = [0.,.1,.2,.3,.4],
+
+            # Whether to accumulate log-likelihoods rather than multiplying
+            # raw probabilities (which underflow to zero in long sessions)
+            log = False,
+
+            # In log mode, subtract the maximum log-likelihood every so many trials
+            # so that the values stay close to zero (0 means never)
+            renorm_every = 20,
+
+            # Hypotheses whose log-likelihood is within this distance of the maximum
+            # count as maximally likely (0 means exact ties only)
+            tol = 0.,
+
+            # Keep the likelihood vectors of this many recent (stimulus, answer)
+            # pairs, so that repeated stimulus levels need not be recomputed (0 means no cache)
+            cache_size = 0,
+
+            # If given, stimuli are rounded to a multiple of this before looking them up
+            # in the cache (and the likelihood is computed at the rounded level)
+            cache_quantum = None,
+
+            # Whether to precompute the psychometric function as a kernel table, so that
+            # an update becomes a slice-and-add (this needs evenly spaced midpoints)
+            kernel = False,
+
+            # The kernel table has this many entries per midpoint spacing
+            # (stimuli in between are linearly interpolated)
+            kernel_oversample = 1,
+
+            # Whether to zoom the midpoint grid in on the likely region once the
+            # likelihood concentrates (hyp_n is then the number of midpoints at each zoom level)
+            adaptive = False,
+
+            # In adaptive mode, midpoints with a log-likelihood within this distance
+            # of the maximum make up the likely region
+            adaptive_margin = 10.,
+
+            # In adaptive mode, do not zoom in beyond this midpoint spacing
+            adaptive_resolution = 0.,
+
+            # If given, drop hypotheses whose log-likelihood falls more than this
+            # below the maximum, and only update the remaining ones (see rebuild())
+            prune = None,
+
+            # Whether to choose the next stimulus as the candidate level with the largest
+            # expected information gain, rather than the sweet point of a maximum likelihood curve
+            infogain = False,
+
+            # In infogain mode, the candidate stimulus levels (by default, the midpoints,
+            # or INFOGAIN_N_CANDIDATES evenly spaced levels across them if there are more)
+            candidates = None,
+
+            # In infogain mode, what we want to learn about: "midpoint" (the gain is
+            # scored on the posterior of the midpoint alone) or "all" (the whole grid,
+            # which also spends trials on the false alarm rate and slope)
+            infogain_params = "midpoint",
+
+            # Seed for choosing between equally likely hypotheses
+            # (None means we use Python's global random module)
+            seed = None,
             
             # The number of trials
             # The number of catch trials (at the lowest stimulus level, to reduce biases in false alarm estimate)
@@ -107,19 +358,526 @@ class MLP:
 
         self.fa = fa
 
+        self.log          = log
+        self.renorm_every = renorm_every
+        self.tol          = tol
+        self._since_renorm = 0
+
+        self.cache_size    = cache_size
+        self.cache_quantum = cache_quantum
+        self.clear_cache()
+
 
         # The threshold hypotheses
         THRESHOLD_HYPOTHESES = np.linspace(self.hyp_min,
                                            self.hyp_max,
                                            self.hyp_n)
 
-        # Initialise our hypotheses
-        self.hypotheses = [ (a,m,1.)  # false alarm rate, threshold, and probability (initially just one)
-                            for a in self.fa
-                            for m in THRESHOLD_HYPOTHESES ]
+        # The hypothesis grid is stored as a structure of arrays:
+        # the parameters of each axis, shaped so that they broadcast
+        # against each other (false alarm rates down, midpoints across),
+        # and one likelihood matrix indexed by (false alarm rate, midpoint).
+        # With several candidate slopes, the slopes come first and the
+        # likelihood array is indexed by (slope, false alarm rate, midpoint).
+        self.midpoints = THRESHOLD_HYPOTHESES
+        if np.ndim(slope):
+            self.slopes = np.asarray(slope,dtype=float)
+            self._k = self.slopes[:,None,None]
+            self._a = np.asarray(self.fa,dtype=float)[None,:,None]
+            self._m = self.midpoints[None,None,:]
+        else:
+            self.slopes = None
+            self._k = slope
+            self._a = np.asarray(self.fa,dtype=float)[:,None]
+            self._m = self.midpoints[None,:]
+
+        # When pruning, the flat grid indices of the hypotheses that are still
+        # in play, and their parameters and likelihoods in contiguous arrays (None means all)
+        self.prune = prune
+        self._active = None
+
+        self.infogain   = infogain
+        self.candidates = candidates
+        self.infogain_params = infogain_params
+
+        self.seed = seed
+        self.rng  = random if seed is None else random.Random(seed)
+
+        # Initialise our hypotheses (the probability is initially just one).
+        # In log mode the grid holds log-likelihoods instead.
+        shape = np.broadcast(self._k,self._a,self._m).shape
+        if self.log:
+            self.grid = np.zeros( shape )
+        else:
+            self.grid = np.ones( shape )
+
+        self.kernel            = kernel
+        self.kernel_oversample = kernel_oversample
+        self._kernel = None
+        if self.kernel:
+            self.build_kernel()
+
+        self.adaptive            = adaptive
+        self.adaptive_margin     = adaptive_margin
+        self.adaptive_resolution = adaptive_resolution
 
         # History
-        self.history = []
+        self.history = TrialHistory()
+
+        self.refresh()
+
+
+
+
+    @classmethod
+    def from_history(cls, stimuli, responses=None, *args, kinds=None, timestamps=None, **kwargs):
+        """
+        Create an MLP object and feed it a whole history of trials at once.
+        The stimuli and responses are sequences with one element per trial
+        (and so are the kinds and timestamps, if given).
+        Alternatively, pass a history as stored in MLP.history (a TrialHistory,
+        or a list of {"stimulus":...,"response":...} entries) and leave responses out.
+        The remaining arguments are passed on to the constructor.
+        """
+        if responses is None:
+            if not isinstance(stimuli,TrialHistory):
+                trials = stimuli
+                stimuli = TrialHistory()
+                stimuli.extend(trials) # (this keeps their kinds and timestamps, if any)
+            (stimuli,responses,kinds,timestamps) = (stimuli.stimulus,stimuli.response,
+                                                    stimuli.kind,stimuli.timestamp)
+        mlp = cls(*args,**kwargs)
+        mlp.update_many(stimuli,responses,kinds=kinds,timestamps=timestamps)
+        return mlp
+
+
+
+
+    def fork(self):
+        """
+        Return a copy of this MLP object that can be taken further (updated,
+        asked for the next stimulus) without touching this one: it has its own
+        likelihoods, history, cache and random generator (in the same state as ours).
+        The parts that are only ever replaced, never changed in place
+        (the midpoints, the kernel tables), are shared.
+        """
+        branch = copy.copy(self)
+        branch.grid = self.grid.copy() # (this also brings our grid up to date)
+        if self._active is not None:
+            branch._active_vals = self._active_vals.copy()
+        branch.history = self.history.copy()
+        branch._cache  = OrderedDict(self._cache)
+        branch.rng = random.Random()
+        branch.rng.setstate(self.rng.getstate())
+        return branch
+
+
+
+    def adopt(self, branch):
+        """
+        Take over the state of a fork of this object (see fork()), as if
+        we had gone through the same updates and queries ourselves. Our random
+        generator stays the same object (which may be the random module)
+        but continues from where the fork's left off.
+        """
+        rng = self.rng
+        self.__dict__.update(branch.__dict__)
+        self.rng = rng
+        self.rng.setstate(branch.rng.getstate())
+
+
+
+    def save(self, fname):
+        """
+        Save the state of this MLP object to a numpy .npz file: the configuration,
+        the likelihood grid, the history and the state of the random generator
+        that breaks ties (the cache of likelihood vectors is not saved).
+        This is cheap enough to do after every trial. The file is first written
+        under a temporary name and then moved into place, so that a crash while
+        saving leaves the previous checkpoint intact.
+        """
+        config = {
+            "slope"        : float(self.slope) if self.slopes is None else self.slopes.tolist(),
+            "hyp_min"      : float(self.hyp_min),
+            "hyp_max"      : float(self.hyp_max),
+            "hyp_n"        : int(self.hyp_n),
+            "fa"           : np.asarray(self.fa,dtype=float).tolist(),
+            "log"          : bool(self.log),
+            "renorm_every" : self.renorm_every,
+            "tol"          : float(self.tol),
+            "cache_size"   : self.cache_size,
+            "cache_quantum": self.cache_quantum,
+            "kernel"       : bool(self.kernel),
+            "kernel_oversample"   : self.kernel_oversample,
+            "adaptive"            : bool(self.adaptive),
+            "adaptive_margin"     : self.adaptive_margin,
+            "adaptive_resolution" : self.adaptive_resolution,
+            "prune"        : self.prune,
+            "infogain"     : bool(self.infogain),
+            "candidates"   : None if self.candidates is None else np.asarray(self.candidates,dtype=float).tolist(),
+            "infogain_params" : self.infogain_params,
+            "seed"         : self.seed,
+        }
+        (version,state,gauss) = self.rng.getstate()
+
+        tmp = fname+".tmp"
+        with open(tmp,'wb') as f:
+            np.savez( f,
+                      config       = json.dumps(config),
+                      midpoints    = self.midpoints,
+                      grid         = self.grid,
+                      stimuli      = self.history.stimulus,
+                      responses    = self.history.response,
+                      kinds        = self.history.kind.astype(str),
+                      timestamps   = self.history.timestamp,
+                      since_renorm = self._since_renorm,
+                      pruned       = self._active is not None,
+                      active       = np.zeros(0,dtype=int) if self._active is None else self._active,
+                      rng_version  = version,
+                      rng_state    = np.array(state,dtype=np.uint64),
+                      rng_gauss    = np.nan if gauss is None else gauss )
+        os.replace(tmp,fname)
+
+
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Restore an MLP object saved with save(). The restored object continues
+        exactly as the saved one would have, including the choice between equally
+        likely hypotheses. Note that if the object was made without a seed, this
+        means the state of Python's global random module is restored as well.
+        """
+        with np.load(fname) as f:
+            mlp = cls(**json.loads(str(f["config"])))
+
+            # In adaptive mode, the grid may have been zoomed in
+            midpoints = f["midpoints"]
+            if not np.array_equal(midpoints,mlp.midpoints):
+                mlp.midpoints = midpoints
+                mlp._m = midpoints.reshape((1,)*(mlp._grid.ndim-1)+(-1,))
+                if mlp.kernel:
+                    mlp.build_kernel()
+
+            mlp.grid = f["grid"]
+            mlp.history = TrialHistory.from_arrays( f["stimuli"], f["responses"],
+                                                    f["kinds"] if "kinds" in f else None,
+                                                    f["timestamps"] if "timestamps" in f else None )
+            mlp._since_renorm = int(f["since_renorm"])
+            if f["pruned"]:
+                mlp._set_active(f["active"])
+                mlp._active_vals = mlp._grid.reshape(-1)[mlp._active]
+
+            gauss = float(f["rng_gauss"])
+            mlp.rng.setstate(( int(f["rng_version"]),
+                               tuple(f["rng_state"].tolist()),
+                               None if np.isnan(gauss) else gauss ))
+
+        mlp.refresh()
+        return mlp
+
+
+
+
+    @property
+    def grid(self):
+        """
+        The likelihood of each hypothesis (the log-likelihood in log mode),
+        indexed by (false alarm rate, midpoint). When pruning, the hypotheses
+        in play are updated in a compact array, and only copied back into
+        the grid when it is looked at.
+        """
+        if self._stale:
+            self._grid.reshape(-1)[self._active] = self._active_vals
+            self._stale = False
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid):
+        self._grid  = grid
+        self._stale = False
+
+
+
+
+    @property
+    def hypotheses(self):
+        """
+        The list of (false alarm rate, threshold, likelihood) tuples,
+        one for each hypothesis (with candidate slopes, the slope is added
+        at the end of each tuple). This is built on the fly from the
+        likelihood grid, so it is best avoided in time-critical code.
+        """
+        shape = self._grid.shape
+        cols = [ np.broadcast_to(self._a,shape).ravel().tolist(),
+                 np.broadcast_to(self._m,shape).ravel().tolist(),
+                 self.get_likelihood().ravel().tolist() ]
+        if self.slopes is not None:
+            cols.append( np.broadcast_to(self._k,shape).ravel().tolist() )
+        return list(zip(*cols))
+
+
+
+
+    def curves(self, x):
+        """
+        Return the probability of a "yes" response to stimulus x
+        for all hypotheses at once, as an array shaped like the grid.
+        """
+        return pyes( x, self._a, self._m, self._k )
+
+
+
+
+    def get_likelihood(self):
+        """ Return the likelihood grid (relative to the last renormalisation in log mode). """
+        if self.log:
+            return np.exp(self.grid)
+        return self.grid
+
+
+
+    def get_loglikelihood(self):
+        """ Return the log-likelihood grid. """
+        if self.log:
+            return self.grid
+        with np.errstate(divide='ignore'):
+            return np.log(self.grid)
+
+
+
+    def observation(self, x, answer):
+        """
+        Return, for all hypotheses at once, the probability of giving
+        this answer to stimulus x, in the domain of the grid
+        (i.e. as a log probability in log mode).
+        If the cache is on, recently used stimulus levels are looked up
+        rather than computed. The returned array should not be modified.
+        """
+        if not self.cache_size:
+            return self._observation(x,answer)
+
+        if self.cache_quantum:
+            x = round(x/self.cache_quantum)*self.cache_quantum
+        key = (float(x),bool(answer))
+
+        obs = self._cache.get(key)
+        if obs is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return obs
+
+        self.cache_misses += 1
+        obs = self._observation(x,answer)
+        obs.flags.writeable = False
+        self._cache[key] = obs
+        if len(self._cache)>self.cache_size:
+            self._cache.popitem(last=False) # forget the least recently used
+        return obs
+
+
+
+    def clear_cache(self):
+        """ Empty the cache of likelihood vectors and reset its counters. """
+        self._cache = OrderedDict()
+        self.cache_hits   = 0
+        self.cache_misses = 0
+
+
+
+    def cache_info(self):
+        """ Return the hits, misses and current size of the cache of likelihood vectors. """
+        return {"hits":self.cache_hits,"misses":self.cache_misses,
+                "size":len(self._cache),"maxsize":self.cache_size}
+
+
+
+    def build_kernel(self):
+        """
+        Precompute the kernel table for the current grid.
+
+        The psychometric function only depends on the distance x-m between the
+        stimulus and the midpoint. With evenly spaced midpoints m0+j*d, the
+        likelihood vector for a stimulus x is therefore a strided slice through
+        one table of the function at distances that are multiples of d/r
+        (r being the oversampling), indexed backwards so that the slice runs
+        along the midpoints. The table covers stimuli up to one grid span
+        beyond either end of the grid; further out, we compute as usual.
+        """
+        m = self.midpoints
+        n,r = len(m),self.kernel_oversample
+        if n<2 or not m[-1]>m[0]:
+            self._kernel = None
+            return
+        d = (m[-1]-m[0])/(n-1)
+        pad = (n-1)*r
+        origin = (n-1)*r+pad  # the table index where x-m is zero
+        length = 2*(n-1)*r+2*pad+2
+
+        # The distance x-m for each entry in the table, running backwards,
+        # with a trailing axis for the table entries
+        dist = (origin-np.arange(length))*d/r
+        a = self._a[...,:1]
+        if self.log:
+            tyes,tno = logpyes( dist, a, 0, self._k )
+        else:
+            tyes = pyes( dist, a, 0, self._k )
+            tno  = 1-tyes
+        tyes = np.broadcast_to(tyes,self._grid.shape[:-1]+(length,)).copy()
+        tno  = np.broadcast_to(tno, self._grid.shape[:-1]+(length,)).copy()
+
+        # For interpolating, we also keep the difference between neighbouring entries
+        dyes = np.diff(tyes,axis=-1)
+        dno  = np.diff(tno, axis=-1)
+        self._kernel = (tyes,tno,dyes,dno,m[0],d,origin)
+
+
+
+    def _kernel_observation(self, x, answer, active=False):
+        """ Look up an observation in the kernel table, or return None
+        if the stimulus is outside the range the table covers.
+        With active=True, only for the hypotheses still in play. """
+        tyes,tno,dyes,dno,m0,d,origin = self._kernel
+        table,diff = (tyes,dyes) if answer else (tno,dno)
+        n,r = self._grid.shape[-1],self.kernel_oversample
+
+        # The (fractional) table index for the first midpoint
+        v = origin-(x-m0)*r/d
+        q = int(np.floor(v))
+        if not (0<=q and q+1+(n-1)*r<table.shape[-1]):
+            return None
+        w = v-q
+
+        if active:
+            # Pick out the table entries of the hypotheses in play
+            obs = np.take(table,self._active_tbase+q)
+            if w>0:
+                obs += w*np.take(diff,self._active_dbase+q)
+            return obs
+
+        obs = table[...,q:q+(n-1)*r+1:r]
+        if w>0:
+            interp = w*diff[...,q:q+(n-1)*r+1:r]
+            interp += obs
+            obs = interp
+        return obs
+
+
+
+    def _observation(self, x, answer, active=False):
+        if self._kernel is not None:
+            obs = self._kernel_observation(x,answer,active)
+            if obs is not None:
+                return obs
+
+        if active:
+            return self._active_observation(x,answer)
+
+        if self.log:
+            lyes,lno = logpyes( x, self._a, self._m, self._k, yes=answer, no=not answer )
+            return lyes if answer else lno
+
+        # Calculate the likelihood of a "yes" response to this stimulus
+        obsp = self.curves(x)
+
+        # If this was a no-response, invert the probability
+        if not answer:
+            obsp = 1-obsp
+        return obsp
+
+
+
+    def _active_observation(self, x, answer):
+        """ The observation for just the hypotheses in play. The logistic part of
+        the psychometric function only depends on the midpoint, so we evaluate
+        it along the midpoints and pick out the ones we need. """
+        a = self._active_a
+        z = np.ravel(self._k*(x-self._m))
+        with np.errstate(divide='ignore',over='ignore'):
+            if self.log and not answer:
+                return self._active_log1ma-np.logaddexp(0,z)[self._active_z]
+
+            sig = (1/(1+np.exp(-z)))[self._active_z]
+            if not answer:
+                return (1-a)*(1-sig)
+            obs = a+(1-a)*sig
+            if not self.log:
+                return obs
+            obs = np.log(obs)
+            if self._active_nofa.any():
+                nofa = self._active_nofa
+                obs[nofa] = -np.logaddexp(0,-z)[self._active_z[nofa]]
+            return obs
+
+
+
+    def accumulate(self, obs, ntrials=1):
+        """ Fold an observation (as returned by observation(), or the combined
+        observation of ntrials trials) into the grid. When pruning, this can
+        also be an observation of just the hypotheses in play. """
+        if self._active is not None and obs.shape!=self._grid.shape:
+            if self.log:
+                self._active_vals += obs
+            else:
+                self._active_vals *= obs
+            self._stale = True
+        elif self.log:
+            self.grid += obs
+        else:
+            self.grid *= obs
+
+        if self.log:
+            # Every so often, shift the log-likelihoods so that the maximum is zero again
+            self._since_renorm += ntrials
+            if self.renorm_every and self._since_renorm>=self.renorm_every:
+                self.renormalise()
+                return
+        self.refresh()
+
+
+
+    def renormalise(self):
+        """ In log mode, subtract the maximum log-likelihood from the grid.
+        This leaves the relative likelihoods (and so all estimates) unchanged. """
+        if self.log:
+            if self._active is None:
+                self.grid -= self.grid.max()
+            else:
+                self._active_vals -= self._active_vals.max()
+                self._stale = True
+        self._since_renorm = 0
+        self.refresh()
+
+
+
+    def refresh(self):
+        """
+        Find the maximum likelihood, the maximally likely hypotheses and the
+        midpoint estimate. This is done whenever the grid changes, so that
+        the queries in between (get_max_like, get_ml, get_midpoint_estimate,
+        print) are reads rather than passes over the grid.
+        Call this after changing the grid directly.
+        """
+        # When pruning, only the hypotheses in play can be the maximum
+        vals = self.grid if self._active is None else self._active_vals
+        maxp = vals.max()
+        if self.log:
+            mask = vals>=maxp-self.tol
+        elif self.tol:
+            mask = vals>=maxp*np.exp(-self.tol)
+        else:
+            mask = vals==maxp
+
+        self._maxp = maxp
+        self._ties = np.flatnonzero(mask)
+        self._tie_vals = vals.reshape(-1)[self._ties]
+        if self._active is not None:
+            self._ties = self._active[self._ties]
+        self._max_like = None # the list of tuples is only made when asked for
+
+        # The midpoint is the last axis of the grid
+        m_s = self.midpoints[self._ties%self._grid.shape[-1]]
+        self._midpoint_estimate = np.mean(m_s) # if there are several, just return the average
 
 
 
@@ -140,60 +898,267 @@ class MLP:
 
         
 
-    def update( self, x, answer ):
+    def update( self, x, answer, kind=None, timestamp=None ):
         # Given a subject's answer (yes=True or no=False) to stimulus intensity x,
         # update the likelihood of the hypotheses.
+        # The kind of trial (e.g. "catch") and a timestamp can be kept in the history too.
         # That is, for each hypotheses, calculate the probability p of
         # that observation assuming that hypothesis.
-        # Then, we multiply the likelihood of that hypothesis with p.
-        # We return the new list of hypotheses.
+        # Then, we multiply the likelihood of that hypothesis with p
+        # (or add log p in log mode).
+        # All hypotheses are done in one go by evaluating the psychometric
+        # function over the whole grid.
 
-        self.history.append({"stimulus":x,"response":answer})
-        
-        newhyp = []
-        for (a,m,p) in self.hypotheses:
+        self.history.append(x,answer,kind,timestamp)
+
+        if self._active is None:
+            self.accumulate( self.observation(x,answer) )
+        else:
+            # Only the hypotheses that are still in play
+            self.accumulate( self._observation(x,answer,active=True) )
+
+        if self.adaptive:
+            self.refine()
+        if self.prune is not None:
+            self.prune_hypotheses()
 
-            # Calculate the likelihood of a "yes" response to this stimulus
-            obsp = pyes( x, a, m, self.slope )
 
-            # If this was a no-response, invert the probability
-            if not answer:
-                obsp = 1-obsp
 
-            # And then add the hypothesis to the new list
-            newhyp.append( (a,m,p*obsp) )
 
-        self.hypotheses = newhyp
+    def update_many( self, stimuli, responses, kinds=None, timestamps=None ):
+        """
+        Update the likelihood of the hypotheses given a series of answers
+        (one per stimulus), in one vectorised pass over the trials.
+        This gives the same result as calling update() for each trial in turn.
+        """
+        stimuli   = np.asarray(stimuli,dtype=float).ravel()
+        responses = np.asarray(responses,dtype=bool).ravel()
 
+        if self._active is None:
+            a,m,k = self._a,self._m,self._k
+        else:
+            a,m,k = self._active_a,self._active_m,self._active_k
+        obs = history_likelihood( stimuli, responses,
+                                  a, m, k,
+                                  log=self.log )
 
+        self.history.extend(stimuli,responses,kinds,timestamps)
 
+        self.accumulate(obs,ntrials=len(stimuli))
 
+        if self.adaptive:
+            self.refine()
+        if self.prune is not None:
+            self.prune_hypotheses()
 
 
-    def get_max_like(self):
 
-        # If there are several (due to being practically equal), just choose a random one
-        # among them
-        # Now check for the maximum likelihood one
-        maxp = max([ p for (_,_,p) in self.hypotheses ])
 
-        # And then find the hypotheses that have this maximum
-        maxlikelihyps = [ (a,m,p)
-                          for (a,m,p) in self.hypotheses 
-                          if p==maxp ]
+    def history_arrays(self):
+        """ Return the stimuli and the responses in the history as two
+        (read-only) arrays. These are views, not copies. """
+        return self.history.stimulus,self.history.response
+
+
 
-        return maxlikelihyps
+
+    def regrid(self, lo, hi, n=None):
+        """
+        Replace the midpoints by n (by default hyp_n) evenly spaced midpoints
+        between lo and hi, and compute their likelihoods from the history
+        in one vectorised pass.
+        """
+        self.midpoints = np.linspace(lo,hi,n or self.hyp_n)
+        self._m = self.midpoints.reshape((1,)*(self._grid.ndim-1)+(-1,))
+
+        # The stored likelihood vectors no longer match the grid
+        self.clear_cache()
+        if self.kernel:
+            self.build_kernel()
+
+        self.rebuild()
+
+
+
+    def rebuild(self):
+        """
+        Recompute the likelihood of every hypothesis in the grid from the
+        history, in one vectorised pass. This also brings back any hypotheses
+        that were pruned (until the next update prunes again).
+        """
+        stimuli,responses = self.history_arrays()
+        self._active = None
+        self.grid = history_likelihood( stimuli, responses,
+                                        self._a, self._m, self._k,
+                                        log=self.log )
+        self.renormalise()
+
+
+
+    def prune_hypotheses(self):
+        """
+        Drop the hypotheses whose log-likelihood is more than prune below the
+        maximum. Their likelihood is set to zero, and further updates only
+        evaluate the remaining ones, whose parameters and likelihoods are
+        kept in contiguous arrays.
+        """
+        if self._active is None:
+            vals = self.grid.reshape(-1)
+        else:
+            vals = self._active_vals
+        if self.log:
+            ll = vals
+        else:
+            with np.errstate(divide='ignore'):
+                ll = np.log(vals)
+
+        # Compacting costs a pass over the hypotheses, so we only do it
+        # once it at least halves the number of hypotheses in play
+        keep = ll>=ll.max()-self.prune
+        if np.count_nonzero(keep)>len(vals)/2:
+            return
+
+        shape = self._grid.shape
+        flat = self.grid.reshape(-1) # (this also brings the grid up to date)
+        if self._active is None:
+            self._active = np.flatnonzero(keep)
+            flat[~keep] = -np.inf if self.log else 0.
+        else:
+            flat[self._active[~keep]] = -np.inf if self.log else 0.
+            self._active = self._active[keep]
+        self._active_vals = flat[self._active]
+        self._set_active(self._active)
+
+
+
+    def _set_active(self, active):
+        """ Make the hypotheses with these flat grid indices the ones in play,
+        and set up their parameters (but not their likelihoods, _active_vals). """
+        shape = self._grid.shape
+        self._active = active
+
+        # The parameters of the hypotheses in play, in contiguous arrays
+        idx = np.unravel_index(self._active,shape)
+        self._active_mid  = idx[-1]
+        self._active_lead = self._active//shape[-1]
+        self._active_a = np.broadcast_to(self._a,shape)[idx].copy()
+        if self.slopes is None:
+            self._active_k = self._k
+            self._active_z = self._active_mid
+        else:
+            # The logistic varies along the slopes and the midpoints, and we
+            # pick out its values from a flattened (slope x midpoint) array
+            self._active_k = self.slopes[idx[0]]
+            self._active_z = idx[0]*shape[-1]+self._active_mid
+        self._active_m = self.midpoints[self._active_mid]
+        self._active_nofa   = self._active_a==0
+        with np.errstate(divide='ignore'):
+            self._active_log1ma = np.log1p(-self._active_a)
+
+        # Where the hypotheses in play are found in the (flattened) kernel tables
+        if self._kernel is not None:
+            length = self._kernel[0].shape[-1]
+            r = self.kernel_oversample
+            self._active_tbase = self._active_lead*length    +self._active_mid*r
+            self._active_dbase = self._active_lead*(length-1)+self._active_mid*r
+
+
+
+    def refine(self):
+        """
+        In adaptive mode, look at where the likely midpoints are, and zoom in on
+        them when they take up less than half of the grid. If they run into the
+        edge of the grid (but not of the hypothesised range hyp_min..hyp_max),
+        zoom back out on that side. Returns whether the grid was changed.
+        """
+        m = self.midpoints
+        n = len(m)
+        if n<2:
+            return False
+        d = (m[-1]-m[0])/(n-1)
+
+        # The midpoints for which any hypothesis is within the margin of the maximum
+        ll = self.get_loglikelihood()
+        likely = (ll>=ll.max()-self.adaptive_margin).reshape(-1,n).any(axis=0)
+        first,last = np.flatnonzero(likely)[[0,-1]]
+
+        # Leave one grid step around the likely region
+        lo = max(self.hyp_min,m[first]-d)
+        hi = min(self.hyp_max,m[last]+d)
+
+        zoomout = False
+        if first==0 and m[0]>self.hyp_min:
+            lo = max(self.hyp_min,m[0]-(m[-1]-m[0]))
+            zoomout = True
+        if last==n-1 and m[-1]<self.hyp_max:
+            hi = min(self.hyp_max,m[-1]+(m[-1]-m[0]))
+            zoomout = True
+
+        zoomin = (hi-lo)<(m[-1]-m[0])/2 and (hi-lo)/(n-1)>=self.adaptive_resolution
+        if not (zoomin or zoomout):
+            return False
+
+        self.regrid(lo,hi,n)
+        return True
+
+
+
+
+
+
+    def get_max_like_mask(self):
+        """ Return a boolean array (shaped like the grid) that is True
+        for the hypotheses that are maximally likely,
+        that is, within a log-likelihood of tol from the maximum. """
+        mask = np.zeros(self._grid.shape,dtype=bool)
+        mask.flat[self._ties] = True
+        return mask
+
+
+
+    def get_max_like(self):
+
+        # The hypotheses that have the maximum likelihood are found in update(),
+        # here we only need to list them
+        if self._max_like is None:
+            a_s,m_s,k_s = self.get_max_like_params()
+            p_s = self._tie_vals
+            if self.log:
+                p_s = np.exp(p_s)
+            cols = [ a_s.tolist(), m_s.tolist(), p_s.tolist() ]
+            if self.slopes is not None:
+                cols.append( k_s.tolist() )
+            self._max_like = list(zip(*cols))
+
+        return list(self._max_like)
+
+
+
+    def get_max_like_params(self):
+        """ Return the false alarm rates, midpoints and slopes of the
+        maximally likely hypotheses, as three arrays. """
+        idx = np.unravel_index(self._ties,self._grid.shape)
+        a_s = np.asarray(self.fa,dtype=float)[idx[-2]]
+        m_s = self.midpoints[idx[-1]]
+        if self.slopes is None:
+            k_s = np.full(len(m_s),float(self.slope))
+        else:
+            k_s = self.slopes[idx[0]]
+        return a_s,m_s,k_s
 
         
 
     def get_ml(self):
         """ Get the current maximum likelihood stimulus. """
 
-        opts = self.get_max_like()
-        
         # If there are several (due to being practically equal), just choose a random one
         # among them
-        return random.choice( opts )
+        j = self.rng.choice( range(len(self._ties)) )
+        idx = np.unravel_index(self._ties[j],self._grid.shape)
+        p = np.exp(self._tie_vals[j]) if self.log else self._tie_vals[j]
+        if self.slopes is None:
+            return (self.fa[idx[-2]],self.midpoints[idx[-1]],p)
+        return (self.fa[idx[-2]],self.midpoints[idx[-1]],p,self.slopes[idx[0]])
 
 
 
@@ -208,18 +1173,113 @@ class MLP:
         level corresponding to a particular target p value.
         So this is just inverting the psychometric function.
         The psychmetric curve is as before, it is defined by the false alarm rate (a)
-        and the threshold location (m).
+        and the threshold location (m), and with candidate slopes, by its slope as well.
         The target_p is a probability from 0 to 1.
         """
 
-        (a,m,_)=params
+        (a,m)=params[:2]
+        k = params[3] if len(params)>3 else self.slope
         
         if p<=a:
             print ("Error, calculating a sweet point below the false alarm rate!")
             return None
 
         y = ((1-a)/(p-a))-1
-        return (np.log(y)/(-self.slope))+m
+        return (np.log(y)/(-k))+m
+
+
+
+    def get_sweetpoints(self, p):
+        """
+        Return the sweet points (see get_sweetpoint) of all the maximally
+        likely hypotheses at once, as an array in the same order as get_max_like().
+        Where the target p is not above the false alarm rate, we return nan.
+        """
+        a,m,k = self.get_max_like_params()
+        with np.errstate(divide='ignore',invalid='ignore'):
+            y = ((1-a)/(p-a))-1
+            stims = (np.log(y)/(-k))+m
+        stims[p<=a] = np.nan
+        return stims
+
+
+
+    def get_infogain(self, candidates, params=None):
+        """
+        Return the expected information gain (in nats) from presenting each of the
+        candidate stimuli, that is, the expected reduction in the entropy of the
+        posterior (with a flat prior). Which posterior is given by params
+        (by default, the infogain_params we were made with):
+         "midpoint" : the marginal posterior of the midpoint, so that trials are
+                      not spent on pinning down the false alarm rate (or slope)
+         "all"      : the posterior over the whole grid
+        Either way, this is the entropy of the predicted answer minus the expected
+        entropy of the answer given the midpoint (or given the hypothesis).
+        The logistic only depends on the slope and midpoint, so the false alarm
+        rates are folded into weights rather than evaluated one by one (except for
+        the entropies in "all" mode), and the candidates are done in blocks of
+        at most INFOGAIN_BLOCK (candidate x slope/midpoint) values, to keep the memory
+        bounded. Hypotheses more than INFOGAIN_CUTOFF below the maximum
+        log-likelihood carry no noticeable weight and are left out.
+        """
+        params = self.infogain_params if params is None else params
+        if params not in ("midpoint","all"):
+            raise ValueError("Unknown infogain parameters {}".format(params))
+        x = np.asarray(candidates,dtype=float).ravel()
+
+        # The posterior, normalised in the log domain, with the hypotheses we leave out
+        # (and those that were pruned) at zero, indexed by (slope, false alarm rate, midpoint)
+        ll = self.get_loglikelihood()
+        ll = ll.reshape((-1,)+ll.shape[-2:])
+        (nk,nfa,nm) = ll.shape
+        top = ll.max()
+        with np.errstate(invalid='ignore'):
+            post = np.where( ll>=top-INFOGAIN_CUTOFF, np.exp(ll-top), 0. )
+        post /= post.sum()
+
+        # One row per (midpoint, slope) pair, ordered by midpoint, with a column per
+        # false alarm rate; we only keep the pairs that carry any weight
+        w = post.transpose(2,0,1).reshape(nm*nk,nfa)
+        cols = np.flatnonzero(w.sum(axis=1)>0)
+        w = w[cols]
+        mid = cols//nk
+        m = self.midpoints[mid]
+        k = self._k if self.slopes is None else self.slopes[cols%nk]
+        a = np.asarray(self.fa,dtype=float)
+
+        # The probability of a "yes" summed over the false alarm rates is
+        # wa + wb*logistic, and over all hypotheses with the same midpoint
+        # we sum these up (they are next to each other)
+        wa = w@a
+        wb = w@(1-a)
+        starts = np.flatnonzero(np.diff(mid,prepend=-1))
+        wm = np.add.reduceat(w.sum(axis=1),starts)
+
+        gain = np.empty(len(x))
+        block = max(1,INFOGAIN_BLOCK//len(cols))
+        for i in range(0,len(x),block):
+            xb = x[i:i+block,None]
+            with np.errstate(divide='ignore',over='ignore'):
+                z = k*(xb-m)
+                sig = 1/(1+np.exp(-z))
+                py = wa+wb*sig
+                q = np.clip(py.sum(axis=1),0.,1.)
+                hq = -(_xlogx(q,np.log(q))+_xlogx(1-q,np.log1p(-q)))
+
+                if params=="midpoint":
+                    qm = np.clip(np.add.reduceat(py,starts,axis=1)/wm,0.,1.)
+                    ent = -(_xlogx(qm,np.log(qm))+_xlogx(1-qm,np.log1p(-qm)))@wm
+                else:
+                    ent = np.zeros(len(xb))
+                    lno_z = -np.logaddexp(0,z)
+                    for j in range(nfa):
+                        if not np.any(w[:,j]):
+                            continue
+                        pyes_ = a[j]+(1-a[j])*sig
+                        lno = np.log1p(-a[j])+lno_z
+                        ent -= (_xlogx(pyes_,np.log(pyes_))+_xlogx(np.exp(lno),lno))@w[:,j]
+            gain[i:i+block] = hq-ent
+        return gain
 
 
 
@@ -230,18 +1290,31 @@ class MLP:
         This means essentially: deciding what is the current
         maximum likelihood hypothesis, finding its corresponding
         psychometric curve, and finding the corresponding sweet point.
+        In infogain mode, we instead present the candidate stimulus
+        that we expect to tell us the most (see get_infogain).
         """
+
+        if self.infogain:
+            if self.candidates is not None:
+                candidates = np.asarray(self.candidates,dtype=float)
+            elif len(self.midpoints)<=INFOGAIN_N_CANDIDATES:
+                candidates = self.midpoints
+            else:
+                candidates = np.linspace(self.midpoints[0],self.midpoints[-1],INFOGAIN_N_CANDIDATES)
+            return candidates[ np.argmax(self.get_infogain(candidates)) ]
         
-        # Get the most probable psychmetric curve
-        candidate = self.get_ml()
-        
-        # Now we calculate the stimulus level corresponding to the "sweet point",
-        # the target p-value that we track, for the maximum likelihood estimate
-        stim = self.get_sweetpoint(
-            candidate,
-            self.calculate_target() )
+        # Calculate the stimulus level corresponding to the "sweet point",
+        # the target p-value that we track, for all maximum likelihood curves
+        stims = self.get_sweetpoints( self.calculate_target() )
+
+        # If there are several (due to being practically equal), just choose a random one
+        # among them (as in get_ml)
+        j = self.rng.choice( range(len(stims)) )
+        if np.isnan(stims[j]):
+            print ("Error, calculating a sweet point below the false alarm rate!")
+            return None
 
-        return stim
+        return stims[j]
 
 
 
@@ -250,56 +1323,77 @@ class MLP:
     def get_midpoint_estimate(self):
         """ Return the current best estimate of the psychometric curve midpoint """
 
-        opts = self.get_max_like()
-        _, m_s, _ = zip(*opts)
-        return np.mean(m_s) # if there are several, just return the average
+        return self._midpoint_estimate
+
 
 
+    def get_posterior_summary(self, credible=.95):
+        """ Return the marginal posteriors, posterior means, modes, credible
+        intervals and entropy of the hypotheses (see posterior_summary). """
+        return posterior_summary( self.get_loglikelihood(), self.midpoints,
+                                  self.fa, self.slopes, credible=credible )
 
 
 
 
-    def plot(self):
 
-        maxp = max([ p for _,_,p in self.hypotheses ])
+
+    def plot(self, top=None, weighted=False):
+        """
+        Plot the psychometric curves of the hypotheses (thicker for more likely ones),
+        the maximum likelihood curves as dashed lines, and the answers so far.
+        All curves are evaluated as one (hypotheses x stimuli) array and drawn as
+        one collection of lines. With top, only that many hypotheses are drawn:
+        the most likely ones, or with weighted=True, a sample drawn in proportion
+        to their likelihood.
+        """
 
         import matplotlib.pyplot as plt
-        import matplotlib.colors as colors
         import matplotlib.cm as cm
+        from matplotlib.collections import LineCollection
+
+        shape = self._grid.shape
+        p = self.get_likelihood().reshape(-1)
+        maxp = p.max()
+
+        # Hypotheses with zero likelihood would be drawn with zero width
+        sel = np.flatnonzero(p)
+        if top is not None and top<len(sel):
+            if weighted:
+                sel = np.random.default_rng().choice( sel, size=top, replace=False, p=p[sel]/p[sel].sum() )
+            else:
+                sel = sel[ np.argpartition(-p[sel],top-1)[:top] ]
 
         stims = np.linspace(self.hyp_min,self.hyp_max,300)
+        def lines(a,m,k):
+            # One line per curve, as a (curves x stimuli x 2) array of points
+            pyess = pyes( stims, a[:,None], m[:,None], k[:,None] )
+            return np.stack( (np.broadcast_to(stims,pyess.shape),pyess), axis=-1 )
+
         plot_thickness = 3.5
-        for (a,m,p) in self.hypotheses:
-            pyess = np.array([ pyes(x,a,m,self.slope) for x in stims ])
-            plt.plot( stims, pyess, lw=(p/maxp)*plot_thickness,
-                      color=cm.jet(p),
-                      alpha=.5 )
+        a = np.broadcast_to(self._a,shape).reshape(-1)[sel]
+        m = np.broadcast_to(self._m,shape).reshape(-1)[sel]
+        k = np.broadcast_to(self._k,shape).reshape(-1)[sel]
+        ax = plt.gca()
+        ax.add_collection(LineCollection( lines(a,m,k),
+                                          linewidths=(p[sel]/maxp)*plot_thickness,
+                                          colors=cm.jet(p[sel]),
+                                          alpha=.5 ))
 
         # Then plot the maximum likelihood estimate nice and thick in a dashed line
-        for (a,m,p) in self.hypotheses:
-            pyess = np.array([ pyes(x,a,m,self.slope) for x in stims ])
-            if p==maxp:
-                plt.plot(
-                    stims, pyess, 
-                    '--',
-                    lw=2.5, 
-                    color="black",
-                    alpha=p/maxp
-                )
+        ax.add_collection(LineCollection( lines(*self.get_max_like_params()),
+                                          linestyles='--',
+                                          linewidths=2.5,
+                                          colors="black" ))
+        ax.autoscale_view()
 
         # Finally, we add the individual answers. The "yes" answers to on top (between 1. and 1.1)
         # the "no" answers below (between -.1 and 0.) 
-        answercolor={ 0: "black",
-                      1: "white" }
-        for x in self.history:
-            stim=x["stimulus"]
-            answer=x["response"]
-
-            if answer==1: answer=1.05
-            if answer==0: answer=-.05
-            plt.plot( stim, answer+random.normalvariate(0,.02),
-                      'o', markersize=8, markeredgewidth=2, markeredgecolor="black",
-                      markerfacecolor=answercolor[x["response"]], alpha=.8 )
+        stim   = self.history.stimulus
+        answer = self.history.response
+        ax.scatter( stim, np.where(answer,1.05,-.05)+np.random.normal(0,.02,len(stim)),
+                    s=8**2, linewidths=2, edgecolors="black",
+                    c=np.where(answer,"white","black"), alpha=.8 )
 
         
 
@@ -310,46 +1404,90 @@ class MLP:
 
 
 
-    def plot_hypotheses(self):
+    def plot_hypotheses(self, mode="linear", live=False):
+        """
+        Show the hypotheses as a (false alarm rate x midpoint) heat map, taken
+        straight from the likelihood grid (with candidate slopes, for each false
+        alarm rate and midpoint we show the most likely slope).
+        mode : "linear" (the likelihood relative to the maximum),
+               "log" (the log-likelihood relative to the maximum, down to -HEATMAP_LOG_FLOOR)
+               or "normalised" (the posterior probability, summing to one)
+        With live=True, the figure is shown without blocking and returned. Calling
+        this again with live=True (say after every update) then only replaces the
+        image data and redraws it by blitting, which is fast enough to watch a session.
+        In "normalised" mode the colour scale changes as we go, which needs a full redraw.
+        """
+        import matplotlib.pyplot as plt
 
-        maxp = max([ p for _,_,p in self.hypotheses ])
+        ll = self.get_loglikelihood()
+        if self.slopes is not None:
+            ll = ll.max(axis=0)
+        top = ll.max()
+        if mode=="linear":
+            data,clim,label = np.exp(ll-top),(0,1),"Likelihood (relative to the maximum)"
+        elif mode=="log":
+            data,clim,label = ll-top,(-HEATMAP_LOG_FLOOR,0),"Log-likelihood (relative to the maximum)"
+        elif mode=="normalised":
+            data = np.exp(ll-top)
+            data /= data.sum()
+            clim,label = (0,data.max()),"Posterior probability"
+        else:
+            raise ValueError("Unknown heat map mode {}".format(mode))
+
+        # The midpoints run along the x axis and the false alarm rates down
+        extent = (self.midpoints[0],self.midpoints[-1],len(self.fa)-.5,-.5)
+
+        # In live mode, if we have drawn this before, just update the image
+        hm = getattr(self,"_heatmap",None)
+        if live and hm is not None and hm["mode"]==mode and plt.fignum_exists(hm["fig"].number):
+            canvas = hm["fig"].canvas
+            hm["im"].set_data(data)
+            if (clim,extent)!=hm["scale"]:
+                # The axes themselves change, so redraw everything
+                hm["im"].set_clim(*clim)
+                hm["im"].set_extent(extent)
+                hm["scale"] = (clim,extent)
+                canvas.draw()
+                hm["background"] = canvas.copy_from_bbox(hm["ax"].bbox)
+            canvas.restore_region(hm["background"])
+            hm["ax"].draw_artist(hm["im"])
+            canvas.blit(hm["ax"].bbox)
+            canvas.flush_events()
+            return hm["fig"]
 
-        fas = list(set([ a for (a,_,_) in self.hypotheses ]))
-        ms  = list(set([ m for (_,m,_) in self.hypotheses ]))
-        fas.sort()
-        ms.sort()
-        
-        print("Hello!")
-
-        import numpy as np
-        import matplotlib.pyplot as plt
-        
-        data = np.zeros( (len(fas),len(ms)) )
-        for (a,m,p) in self.hypotheses:
-            fi = fas.index(a)
-            mi = ms.index(m)
-            data[fi,mi]=p
-            
         # Heat map
         fig, ax = plt.subplots()
         im = ax.imshow(
             data,aspect='auto',interpolation='none',
-            #origin = 'lower',
-            #extent = [min(ms), max(ms),
-            #          min(fas), max(fas)]
+            extent = extent,
+            vmin = clim[0], vmax = clim[1],
+            animated = live,
         )
         
         # Add the color bar
         cbar = ax.figure.colorbar(im, ax = ax)
-        cbar.ax.set_ylabel("Probability", rotation = -90, va = "bottom")
+        cbar.ax.set_ylabel(label, rotation = -90, va = "bottom")
 
         # Axis labels
-        plt.yticks( range(len(fas)), fas)
-        #plt.xticks( range(len(ms)), ms)
-        plt.xlabel("Hypothesis curve midpoint")
-        plt.ylabel("False alarm rate")
-        
-        plt.show()
+        ax.set_yticks( range(len(self.fa)) )
+        ax.set_yticklabels( [ str(f) for f in self.fa ] )
+        ax.set_xlabel("Hypothesis curve midpoint")
+        ax.set_ylabel("False alarm rate")
+
+        if not live:
+            plt.show()
+            return fig
+
+        # Draw everything but the image, keep that as the background, and then blit the image on top
+        plt.show(block=False)
+        fig.canvas.draw()
+        background = fig.canvas.copy_from_bbox(ax.bbox)
+        ax.draw_artist(im)
+        fig.canvas.blit(ax.bbox)
+        fig.canvas.flush_events()
+        self._heatmap = {"fig":fig,"ax":ax,"im":im,"mode":mode,
+                         "scale":(clim,extent),"background":background}
+        return fig
 
 
 
@@ -0,0 +1,153 @@
+"""
+
+Simulating the MLP procedure.
+
+Here we run a whole ensemble of simulated observers through the
+procedure in lock-step, as in tests/simulate.py but with one MLPBank
+session per run. The observers' answers, the likelihood updates and
+the choice of the next stimulus are all done as array operations
+across the ensemble.
+
+"""
+#
+import numpy as np
+
+from pythonmlp.mlp import pyes
+from pythonmlp.bank import MLPBank
+
+
+
+
+class SimulationResult:
+    """
+    The outcome of a simulation. All arrays have one row per run:
+     stimuli   : (runs x trials) the stimulus presented on each trial
+     responses : (runs x trials) whether the observer said "yes"
+     catch     : (trials) whether each trial was a catch trial
+     estimates : (runs) the final midpoint estimate
+     truth_a, truth_m, truth_s : (runs) the ground truth of each observer
+    """
+
+    def __init__(self, stimuli, responses, catch, estimates, truth_a, truth_m, truth_s):
+        self.stimuli   = stimuli
+        self.responses = responses
+        self.catch     = catch
+        self.estimates = estimates
+        self.truth_a   = truth_a
+        self.truth_m   = truth_m
+        self.truth_s   = truth_s
+
+
+
+    def bias(self):
+        """ The mean difference between the midpoint estimate and the truth """
+        return np.mean(self.estimates-self.truth_m)
+
+
+
+    def sd(self):
+        """ The standard deviation of the midpoint estimate around the truth """
+        return np.std(self.estimates-self.truth_m)
+
+
+
+    def to_dataframe(self):
+        """ Return the trials as a tidy pandas data frame, one row per trial per run """
+        import pandas as pd
+
+        runs,trials = self.stimuli.shape
+        return pd.DataFrame({
+            "run"      : np.repeat(np.arange(runs),trials),
+            "trial"    : np.tile(np.arange(1,trials+1),runs),
+            "kind"     : np.tile(np.where(self.catch,"catch","mlp"),runs),
+            "stimulus" : self.stimuli.ravel(),
+            "response" : self.responses.ravel(),
+            "truth_m"  : np.repeat(self.truth_m,trials),
+            "estimate" : np.repeat(self.estimates,trials),
+        })
+
+
+
+
+def simulate(
+
+        # The number of simulated observers, and the number of trials for each
+        n_runs,
+        n_trials,
+
+        # The ground truth psychometric curve of the observers
+        # (each can also be an array with one value per run)
+        truth_a,
+        truth_m,
+        truth_s,
+
+        # The configuration of the MLP procedure (as for MLP)
+        slope,
+        hyp_min,
+        hyp_max,
+        hyp_n,
+        fa,
+        log = True,
+        tol = 0.,
+
+        # The first stimulus level (by default, the maximum hypothesised threshold)
+        initial = None,
+
+        # Stimuli are clipped to this range (None means no limit)
+        stim_min = 0,
+        stim_max = None,
+
+        # Optionally, which trials are catch trials (presented at hyp_min)
+        catch = None,
+
+        # Seed (or numpy SeedSequence) for the observers' answers
+        # and for breaking ties in the procedure
+        seed = None,
+):
+    """
+    Run n_runs simulated observers through n_trials of the MLP procedure
+    and return a SimulationResult.
+    """
+
+    if not isinstance(seed,np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    bankseed,answerseed = seed.spawn(2)
+    rng = np.random.default_rng(answerseed)
+
+    bank = MLPBank(n_runs,slope=slope,hyp_min=hyp_min,hyp_max=hyp_max,hyp_n=hyp_n,fa=fa,
+                   log=log,tol=tol,seed=bankseed)
+    if bank.template.calculate_target()<=max(fa):
+        raise ValueError("The tracking target is below the highest false alarm rate, so there is no sweet point")
+
+    truth_a = np.broadcast_to(np.asarray(truth_a,dtype=float),(n_runs,))
+    truth_m = np.broadcast_to(np.asarray(truth_m,dtype=float),(n_runs,))
+    truth_s = np.broadcast_to(np.asarray(truth_s,dtype=float),(n_runs,))
+
+    if catch is None:
+        catch = np.zeros(n_trials,dtype=bool)
+    catch = np.asarray(catch,dtype=bool)
+
+    stimuli   = np.empty((n_runs,n_trials))
+    responses = np.empty((n_runs,n_trials),dtype=bool)
+
+    stim = np.full(n_runs,float(hyp_max if initial is None else initial))
+    for trial in range(n_trials):
+
+        if stim_min is not None or stim_max is not None:
+            stim = np.clip(stim,stim_min,stim_max)
+        if catch[trial]:
+            stim = np.full(n_runs,float(hyp_min))
+
+        # The observers answer "yes" with the probability given by their psychometric curve
+        ans = rng.random(n_runs)<pyes(stim,truth_a,truth_m,truth_s)
+
+        bank.update(stim,ans)
+        stimuli[:,trial]   = stim
+        responses[:,trial] = ans
+
+        stim = bank.next_stimulus()
+
+    return SimulationResult(stimuli,responses,catch,
+                            bank.get_midpoint_estimate(),
+                            np.array(truth_a),np.array(truth_m),np.array(truth_s))
+
@@ -0,0 +1,149 @@
+"""
+
+Working out the next trial ahead of time.
+
+While a stimulus plays and the participant makes up their mind, there
+are only two ways the trial can end: "yes" or "no". A Speculator takes
+both branches in worker threads (each on a fork of the MLP object, see
+MLP.fork): it updates the likelihoods with that answer, chooses the next
+stimulus and, optionally, renders it. Once the real answer is in,
+commit() hands the MLP object the state of that branch (see MLP.adopt),
+so the work between the keypress and the next trial is only waiting for
+a branch that is most likely already done.
+
+The outcome is the same as calling update() and next_stimulus() in turn,
+down to the state of the random generator that breaks ties.
+
+"""
+#
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+
+class Speculator:
+    """
+    Takes both possible answers to the current trial ahead of time.
+
+        spec = Speculator(mlp, render=task.render)
+        spec.start(stim)                    # as soon as we know the stimulus
+        task.playstim(stim)                 # ... meanwhile, both branches are computed
+        stim,rendering = spec.commit(ans)   # mlp is now updated with ans
+
+    """
+
+    def __init__(
+            self,
+
+            # The MLP object whose trials we take ahead of time
+            mlp,
+
+            # Optionally, a function that renders a stimulus level (e.g. into samples
+            # to play); it is called in a worker thread, so it must be safe to do so
+            render = None,
+    ):
+        self.mlp    = mlp
+        self.render = render
+
+        # The two branches are computed side by side (numpy lets go of the
+        # interpreter lock during the heavy lifting). The branch that was not
+        # taken runs to the end, so there is room for the next trial's branches too.
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        self.pending = None
+
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+    def _branch(self, branch, x, answer, kind):
+        # Take the trial further on a fork: update, choose the next stimulus and render it
+        branch.update(x,answer,kind)
+        stim = branch.next_stimulus()
+        rendering = None
+        if self.render is not None and stim is not None:
+            rendering = self.render(stim)
+        return branch,stim,rendering
+
+
+
+    def start(self, x, kind=None):
+        """
+        Start computing what follows a trial at stimulus x (of the given kind,
+        as for MLP.update), for both answers. The MLP object must be left alone
+        until commit() or cancel().
+        """
+        self.cancel()
+
+        # The forks are made here, so that the workers never look at the MLP object itself
+        forks = { answer:self.mlp.fork() for answer in (True,False) }
+        self.pending = {
+            "x"       : x,
+            "kind"    : kind,
+            "ntrials" : len(self.mlp.history),
+            "rng"     : self.mlp.rng.getstate(),
+            True      : self.pool.submit(self._branch,forks[True], x,True, kind),
+            False     : self.pool.submit(self._branch,forks[False],x,False,kind),
+        }
+
+
+
+    def commit(self, answer, timestamp=None):
+        """
+        Given the answer to the trial started with start(), bring the MLP object
+        up to date as update() would, and return the next stimulus (as next_stimulus()
+        would) together with its rendering (None if there is no render function).
+        If the branch failed, or the MLP object was changed in the meantime,
+        we do the work here instead.
+        """
+        pending = self.pending
+        if pending is None:
+            raise ValueError("No trial was started")
+        self.pending = None
+        answer = bool(answer)
+        pending[not answer].cancel()
+
+        mlp = self.mlp
+        result = None
+        try:
+            result = pending[answer].result()
+        except Exception as e:
+            print("Error computing the next trial ahead of time: {}".format(e))
+
+        if result is None or len(mlp.history)!=pending["ntrials"] or mlp.rng.getstate()!=pending["rng"]:
+            mlp.update(pending["x"],answer,pending["kind"],timestamp)
+            stim = mlp.next_stimulus()
+            rendering = None
+            if self.render is not None and stim is not None:
+                rendering = self.render(stim)
+            return stim,rendering
+
+        (branch,stim,rendering) = result
+        mlp.adopt(branch)
+        mlp.history.stamp(timestamp)
+        return stim,rendering
+
+
+
+    def cancel(self):
+        """ Drop the trial that was started (if any), waiting for its branches to finish. """
+        if self.pending is not None:
+            for answer in (True,False):
+                if not self.pending[answer].cancel():
+                    try:
+                        self.pending[answer].result()
+                    except Exception:
+                        pass
+            self.pending = None
+
+
+
+    def close(self):
+        """ Drop any pending trial and stop the worker threads. """
+        self.cancel()
+        self.pool.shutdown()
@@ -0,0 +1,170 @@
+"""
+
+Parameter sweeps for designing an MLP procedure.
+
+To choose the slope, the number of hypotheses, the false alarm rates and
+the number of trials for a new task, we simulate many configurations of
+the procedure against many ground truth observers. Each (configuration,
+observer) pair is one job, which runs an ensemble of simulated observers
+(see pythonmlp.simulate). The jobs are spread over a pool of processes,
+and each job gets its own random stream derived from one seed, so the
+results do not depend on how the jobs are scheduled.
+
+"""
+#
+import csv
+import itertools
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pythonmlp.simulate import simulate
+
+
+
+
+def expand_grid(**axes):
+    """
+    Return the list of all combinations of the given values, as dicts.
+    For example expand_grid(slope=[.05,.1], hyp_n=[100,200]) gives four
+    configurations.
+    """
+    keys = list(axes.keys())
+    return [ dict(zip(keys,values)) for values in itertools.product(*axes.values()) ]
+
+
+
+
+# The summary fields of each row, after the configuration and the observer
+SUMMARY_FIELDS = ["n_trials","n_runs","mean_estimate","bias","sd","rmse","seconds"]
+
+def sweep_columns(configs, observers):
+    """
+    Return the columns of the sweep table: the job indices, every argument that
+    appears in any of the configurations or observers (in order of appearance),
+    and the summary fields.
+    """
+    columns = ["config","observer"]
+    for d in list(configs)+list(observers):
+        for k in d:
+            if k not in columns and k not in SUMMARY_FIELDS:
+                columns.append(k)
+    return columns+SUMMARY_FIELDS
+
+
+
+
+def _run_job(job):
+    """ Run one (configuration, observer) job and summarise it in a table row. """
+    (ci,config,oi,observer,n_runs,n_trials,seed) = job
+
+    config = dict(config)
+    n_trials = config.pop("n_trials",n_trials)
+
+    t0 = time.time()
+    sim = simulate(n_runs=n_runs,n_trials=n_trials,seed=seed,**observer,**config)
+    err = sim.estimates-sim.truth_m
+
+    row = {"config":ci,"observer":oi}
+    for k,v in config.items():
+        row[k] = ",".join([ str(f) for f in v ]) if np.ndim(v) else v
+    row.update(observer)
+    row.update({
+        "n_trials"      : n_trials,
+        "n_runs"        : n_runs,
+        "mean_estimate" : np.mean(sim.estimates),
+        "bias"          : np.mean(err),
+        "sd"            : np.std(err),
+        "rmse"          : np.sqrt(np.mean(err**2)),
+        "seconds"       : time.time()-t0,
+    })
+    return row
+
+
+
+
+def iter_sweep(configs, observers, n_runs, n_trials, seed=None, max_workers=None):
+    """
+    Run every configuration against every observer, and yield one
+    summary row (a dict) per job as soon as it finishes.
+
+    configs   : a list of dicts with the arguments for simulate() that describe
+                the procedure (slope, hyp_min, hyp_max, hyp_n, fa, ...),
+                optionally including n_trials
+    observers : a list of dicts with truth_a, truth_m and truth_s
+    n_runs    : the number of simulated observers in each job
+    max_workers : the number of processes (by default, one per CPU);
+                  with 0, the jobs are run one by one in this process
+    """
+    jobseeds = np.random.SeedSequence(seed).spawn(len(configs)*len(observers))
+    jobs = [ (ci,config,oi,observer,n_runs,n_trials,jobseeds[ci*len(observers)+oi])
+             for ci,config in enumerate(configs)
+             for oi,observer in enumerate(observers) ]
+
+    if max_workers==0:
+        for job in jobs:
+            yield _run_job(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        futures = [ pool.submit(_run_job,job) for job in jobs ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # If we are interrupted, do not start the jobs that are still waiting
+            for future in futures:
+                future.cancel()
+
+
+
+
+def sweep(configs, observers, n_runs, n_trials, seed=None, max_workers=None, out=None):
+    """
+    Run a parameter sweep (see iter_sweep) and return the results as a
+    pandas data frame with one row per (configuration, observer) job.
+    If out is a file name, each row is also appended to that CSV file as
+    soon as it comes in, so that partial results survive an interruption.
+    The columns are fixed up front (see sweep_columns), and arguments that a
+    configuration leaves out are left empty. An existing file is only appended
+    to if it has exactly the same columns (otherwise we raise a ValueError).
+    On KeyboardInterrupt, the rows collected so far are returned.
+    """
+    import pandas as pd
+
+    columns = sweep_columns(configs,observers)
+    writer = None
+    if out is not None:
+        if os.path.exists(out) and os.path.getsize(out)>0:
+            with open(out,'r',newline='',encoding='utf-8') as f:
+                existing = next(csv.reader(f),[])
+            if existing!=columns:
+                raise ValueError("Cannot append to {}: its columns {} differ from those of this sweep {}".format(
+                    out,existing,columns))
+            f = open(out,'a',newline='',encoding='utf-8')
+            writer = csv.DictWriter(f,fieldnames=columns,restval="")
+        else:
+            f = open(out,'w',newline='',encoding='utf-8')
+            writer = csv.DictWriter(f,fieldnames=columns,restval="")
+            writer.writeheader()
+            f.flush()
+
+    rows = []
+    try:
+        for row in iter_sweep(configs,observers,n_runs,n_trials,seed=seed,max_workers=max_workers):
+            rows.append(row)
+            if writer is not None:
+                writer.writerow(row)
+                f.flush()
+    except KeyboardInterrupt:
+        print("Sweep interrupted after {} job(s)".format(len(rows)))
+    finally:
+        if writer is not None:
+            f.close()
+
+    table = pd.DataFrame(rows,columns=columns)
+    if len(table):
+        table = table.sort_values(["config","observer"],ignore_index=True)
+    return table
+
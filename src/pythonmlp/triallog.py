@@ -0,0 +1,153 @@
+"""
+
+Logging trials as they happen.
+
+A TrialLog appends one line per trial to a CSV file, and flushes it
+(and optionally syncs it to disk) after every trial, so that a crash
+loses at most the trial that was being written. read_trials streams
+the records back, and replay_trials rebuilds an MLP object from them
+in one vectorised pass (see MLP.from_history).
+
+"""
+#
+import os
+
+from pythonmlp.mlp import MLP
+
+
+
+
+class TrialLog:
+    """
+    An append-only CSV log with one line per trial. If the file already
+    exists, we carry on appending to it (after dropping a partly written
+    last line, if a previous session crashed while writing it), but only
+    if it has the same columns (otherwise we raise a ValueError).
+    """
+
+    def __init__(
+            self,
+
+            # The file to write to
+            fname,
+
+            # The fields of each record, in order
+            columns = ("trial","kind","stimulus","response"),
+
+            # When to hand the records to the operating system:
+            #  "none"  : leave it to Python's buffering (fast, but a crash can lose trials)
+            #  "flush" : flush after every trial (survives a crash of our process)
+            #  "fsync" : flush and sync to disk after every trial (survives a power cut)
+            sync = "flush",
+    ):
+        if sync not in ("none","flush","fsync"):
+            raise ValueError("Unknown sync policy {}".format(sync))
+
+        self.fname   = fname
+        self.columns = tuple(columns)
+        self.sync    = sync
+
+        # Drop a partly written last line
+        if os.path.exists(fname):
+            with open(fname,'r+b') as f:
+                data = f.read()
+                if len(data) and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n")+1)
+
+        newfile = not os.path.exists(fname) or os.path.getsize(fname)==0
+        if not newfile:
+            with open(fname,'r',encoding='utf-8') as f:
+                existing = tuple(f.readline().rstrip("\n").split(","))
+            if existing!=self.columns:
+                raise ValueError("Cannot append to {}: its columns {} differ from {}".format(
+                    fname,existing,self.columns))
+
+        self.file = open(fname,'a',encoding='utf-8')
+        if newfile:
+            self.file.write(",".join(self.columns)+"\n")
+            self._sync()
+
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+    def log(self, record=None, **fields):
+        """
+        Append one trial, given as a dict and/or as keyword arguments
+        (with one value for each column; floats are written exactly).
+        """
+        if record is not None:
+            fields = dict(record,**fields)
+        values = [ fields[c] for c in self.columns ]
+        self.file.write(",".join([ repr(float(v)) if isinstance(v,float) else str(v)
+                                   for v in values ])+"\n")
+        self._sync()
+
+
+
+    def _sync(self):
+        if self.sync=="none":
+            return
+        self.file.flush()
+        if self.sync=="fsync":
+            os.fsync(self.file.fileno())
+
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.flush()
+            self.file.close()
+
+
+
+
+def _parse(value):
+    # Read back a value as written by TrialLog.log
+    if value in ("True","False"):
+        return value=="True"
+    for kind in (int,float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+
+
+def read_trials(fname):
+    """
+    Yield the trials in a TrialLog file one by one, as dicts.
+    A partly written last line (from a crash) is skipped.
+    """
+    with open(fname,'r',encoding='utf-8') as f:
+        columns = f.readline().rstrip("\n").split(",")
+        for line in f:
+            if not line.endswith("\n"):
+                return
+            values = line.rstrip("\n").split(",")
+            if len(values)!=len(columns):
+                continue
+            yield dict(zip(columns,[ _parse(v) for v in values ]))
+
+
+
+
+def replay_trials(fname, *args, **kwargs):
+    """
+    Rebuild an MLP object from a TrialLog file, feeding it all trials at once.
+    The remaining arguments are passed on to the MLP constructor.
+    """
+    trials = list(read_trials(fname))
+    return MLP.from_history( [ t['stimulus'] for t in trials ],
+                             [ bool(t['response']) for t in trials ],
+                             *args,
+                             kinds=[ str(t.get('kind',"")) for t in trials ],
+                             **kwargs )
@@ -12,10 +12,10 @@ import pygame
 
 import random
 import sys
+import os
 from ehrlesamson    import * 
 import pythonmlp
 import time
-import pandas as pd
 
 
 displaySize = (1024,600) # for widescreen
@@ -43,6 +43,12 @@ RESPONSE_KEYS = [ pygame.K_r, pygame.K_i ]
 # The (fixed) slope of our psychometric curves
 SLOPE_HYP = .1
 
+# Alternatively, a list of candidate slopes makes the MLP estimate the slope along
+# with the threshold and false alarm rate. This changes the protocol, and with blocks
+# as short as ours it tends to make the threshold estimate worse (unless the real
+# slope is steep), so only switch this on deliberately:
+#SLOPE_HYP = [.025,.05,.1,.2,.4]
+
 # The minimum and maximum of the hypothesised thresholds
 MINHYP = 0
 MAXHYP = 200
@@ -57,6 +63,11 @@ FALSE_ALARM_RATES = [0.,.1,.2,.3,.4]
 INITIAL_STIM = MAXHYP
 MAX_STIM = MAXHYP
 
+# If there is a pre-rendered stimulus bank (see build-stimulus-bank.py), we play from it
+STIMULUS_BANK = "anisochrony-bank.npy"
+if not os.path.exists(STIMULUS_BANK):
+    STIMULUS_BANK = None
+
 
 
 
@@ -261,7 +272,7 @@ def evaluateGUI(stim):
 
 def runblock(block,participant):
 
-    task = EhrleSamson()
+    task = EhrleSamson(bank=STIMULUS_BANK)
     
     if block=="try":
         # A short try-out block that contains only 4 trials,
@@ -294,7 +305,7 @@ def runblock(block,participant):
 
     mlp = pythonmlp.MLP(
     
-        # The slope of our psychometric curves
+        # The slope of our psychometric curves (or the candidate slopes, see SLOPE_HYP)
         slope = SLOPE_HYP, # this is a cheat, we give the real psychometric curve slope...
         
         # The minimum and maximum of the hypothesised thresholds
@@ -306,6 +317,9 @@ def runblock(block,participant):
         
         # Our false alarm rates (these will be crossed with the threshold hypotheses)
         fa = FALSE_ALARM_RATES,
+
+        # Catch trials are all at the same level, so remember their likelihoods
+        cache_size = 8,
     )
     
         
@@ -318,19 +332,34 @@ def runblock(block,participant):
     todo = ["mlp"] + trials #+ trialsB # this is done so that the first trial is never a catch
     
     # Now let's run those trials
+
+    # Each trial is written to the CSV file as soon as it is done, and we save
+    # the state of the MLP after every trial, so that if we crash mid-block
+    # we can pick up from there (see pythonmlp.replay_trials and pythonmlp.MLP.load)
+    formatted_time = time.strftime('%Y%m%d-%H%M%S')
+    fname      = "{}-anisochrony-{}.csv".format(participant,formatted_time)
+    checkpoint = "{}-anisochrony-{}-{}.npz".format(participant,block,formatted_time)
+    triallog = pythonmlp.TrialLog(fname,columns=("trial","kind","stimulus","response","task"))
     
     stim = INITIAL_STIM # start at the maximum level
+    rendering = None
+
+    # While a sequence plays and the participant decides, we already work out
+    # the next stimulus (and render it) for both possible answers, so that
+    # after the keypress we only need to pick the branch for the real answer
+    speculator = pythonmlp.Speculator(mlp,render=task.render)
     
-    trials = []
     for trial,info in enumerate(todo):
             
         stim = stim if stim>0 else 0 # set to 0 if lower
-        stim = 0 if info=='catch' else stim
+        if info=='catch':
+            stim,rendering = 0,None
         
         textScreen(screen,mainfont,u"Écoutez...")
         pygame.display.flip()
 
-        task.playstim(stim)
+        speculator.start(stim,kind=info)
+        task.playstim(stim,rendering)
 
         textScreen(screen,mainfont,u"Est-ce que les sons étaient régulier (appuyer sur R) ou irrégulier (appuyer sur I)?")
         pygame.display.flip()
@@ -339,22 +368,20 @@ def runblock(block,participant):
         ans = (key==2) # answer is True when response is irregular (change heard)
 
         
-        mlp.update(stim,ans)
-        trials.append({
+        # This updates the MLP as mlp.update(stim,ans,...) and gives mlp.next_stimulus()
+        (nextstim,rendering) = speculator.commit(ans,timestamp=time.time())
+        mlp.save(checkpoint)
+        triallog.log({
             "trial":trial+1,
             "kind":info,
             "stimulus":stim,
-            "response":ans
+            "response":ans,
+            "task":"anisochrony"
             })
-        stim = mlp.next_stimulus()
+        stim = nextstim
 
-    from datetime import datetime
-    current_time = datetime.now()
-    formatted_time = current_time.strftime('%Y%m%d-%H%M%S')
-    fname = "{}-anisochrony-{}.csv".format(participant,formatted_time)
-    trials = pd.DataFrame(trials)
-    trials['task']='anisochrony'
-    trials.to_csv(fname,index=False)
+    speculator.close()
+    triallog.close()
 
 
 
@@ -362,7 +389,7 @@ def runblock(block,participant):
 def instruct():
     """Give the instructions for this task"""
 
-    task = EhrleSamson()
+    task = EhrleSamson(bank=STIMULUS_BANK)
 
     keepGoing=True
     while keepGoing:
@@ -431,6 +458,10 @@ while not len(participant)>0:
 
 screen = init()
 
+# Render the sequences we will hear again and again (the catch trials, the
+# demonstrations and the first trial of each block) before we start
+EhrleSamson(bank=STIMULUS_BANK).prewarm([ 0, MINHYP, MAXHYP, INITIAL_STIM ])
+
 instruct()
 
 blocks = ["try","train","1","2","3"]
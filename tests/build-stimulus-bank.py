@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+
+Pre-render all the stimuli of the anisochrony task into one stimulus bank
+file, which the task then plays from (see StimulusBank in ehrlesamson.py).
+
+Usage:
+   python build-stimulus-bank.py [bank file] [maximum deviation in msec]
+
+By default, this writes anisochrony-bank.npy (and anisochrony-bank.npy.index.npz)
+with every deviation up to the length of the silence between the tones.
+
+"""
+
+import sys
+import time
+from ehrlesamson import *
+
+
+fname   = sys.argv[1] if len(sys.argv)>1 else "anisochrony-bank.npy"
+max_dev = float(sys.argv[2]) if len(sys.argv)>2 else None
+
+t0 = time.time()
+bank = build_stimulus_bank(fname,max_dev=max_dev)
+print("Wrote {} sequences ({:.1f} MB) to {} in {:.1f} s".format(
+    len(bank),bank.samples.nbytes/2**20,fname,time.time()-t0))
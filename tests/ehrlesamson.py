@@ -9,11 +9,14 @@ This is what Ehrle & Samson (2005) did too.
 """
 
 from subprocess import call # used to call the external player
+from collections import OrderedDict
 import math
 import numpy as np
 import os
 import platform
 import sys
+import threading
+import time
 import scipy.io.wavfile
 
 
@@ -39,6 +42,292 @@ def sine_wave(frequency, framerate, amplitude, length):
 
 
 
+def linear_fade(signal, fade_length):
+    """ Return a copy of the signal with a linear fade-in and fade-out of fade_length samples.
+    Sample i of the fade-in is scaled by i/fade_length, and so is sample -i of the fade-out
+    (so the very first sample is silenced, and the last one is scaled by 1/fade_length). """
+    signal = np.array(signal,dtype=float)
+    ramp = np.arange(fade_length)
+    signal[:fade_length] = signal[:fade_length]*ramp/fade_length
+    signal[-ramp] = signal[-ramp]*ramp/fade_length
+    return signal
+
+
+
+
+class ToneSequenceSynth:
+    """
+    Renders sequences of one and the same tone: each sequence is silence with
+    copies of the tone written in at given onsets (in samples).
+    The sequence is written into one buffer, which can be kept and reused
+    from one sequence to the next (so that rendering allocates nothing).
+    """
+
+    def __init__(self, tone, reuse=False):
+        self.tone   = np.asarray(tone,dtype=float)
+        self.reuse  = reuse
+        self.buffer = None
+
+
+
+    def render(self, onsets, length, out=None):
+        """
+        Return a sequence of length samples with the tone starting at each of the onsets.
+        The result is written into out if given, or else in reuse mode into our buffer
+        (so it is only valid until the next call), or else into a new array.
+        """
+        if out is None:
+            if self.reuse:
+                if self.buffer is None or len(self.buffer)<length:
+                    self.buffer = np.empty(length)
+                out = self.buffer[:length]
+            else:
+                out = np.empty(length)
+
+        out[:] = 0
+        n = len(self.tone)
+        for onset in onsets:
+            out[onset:onset+n] = self.tone
+        return out
+
+
+
+
+class RenderCache:
+    """
+    A cache of rendered sequences, which holds at most max_bytes worth of
+    samples and drops the least recently used sequences to stay under that.
+    The cached arrays are read-only, as they are handed out to every caller.
+    The cache can be used from several threads at once.
+    """
+
+    def __init__(self, max_bytes=64*2**20):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clear()
+
+
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.nbytes  = 0
+            self.hits    = 0
+            self.misses  = 0
+
+
+
+    def get(self, key):
+        """ Return the sequence stored under key (or None). """
+        with self.lock:
+            values = self.entries.get(key)
+            if values is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return values
+
+
+
+    def put(self, key, values):
+        """ Store a sequence under key, dropping the oldest ones if we run out of room. """
+        if values.nbytes>self.max_bytes:
+            return
+        values.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = values
+            self.nbytes += values.nbytes
+            while self.nbytes>self.max_bytes:
+                _,old = self.entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+
+
+    def info(self):
+        return {"hits":self.hits,"misses":self.misses,
+                "size":len(self.entries),"nbytes":self.nbytes,"max_bytes":self.max_bytes}
+
+
+
+
+# The rendered sequences, shared by all EhrleSamson objects in this process
+RENDER_CACHE = RenderCache()
+
+# The tone and preface for each audio configuration, so we only make them once
+_TONES = {}
+
+
+
+
+def to_pcm(values, out):
+    """ Write samples (floats between -1 and 1) into out as 16-bit samples. """
+    return np.multiply(values,32767,out=out,casting='unsafe')
+
+
+
+
+class StimulusBank:
+    """
+    All the sequences of a task, rendered ahead of time (see build_stimulus_bank)
+    as 16-bit samples into one file, which we map into memory. Sequence i is the
+    one where the fourth tone is delayed by i samples; get(i) returns it as a
+    slice of the file, so nothing is rendered or copied. Processes that map the
+    same file share its pages.
+    """
+
+    def __init__(self, fname):
+        self.fname   = fname
+        self.samples = np.load(fname,mmap_mode='r')
+        with np.load(fname+".index.npz") as f:
+            self.offsets = f["offsets"]
+            self.lengths = f["lengths"]
+            self.config  = tuple(f["config"].tolist())
+
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+
+    def get(self, frames):
+        """ The sequence with the fourth tone delayed by this many samples,
+        or None if it is not in the bank. """
+        if not 0<=frames<len(self.offsets):
+            return None
+        start = self.offsets[frames]
+        return self.samples[start:start+self.lengths[frames]]
+
+
+
+
+def build_stimulus_bank(fname, max_dev=None, task=None):
+    """
+    Render every distinct sequence of the task (by default, an EhrleSamson with the
+    standard settings), from no delay up to max_dev msec (by default, the whole silence),
+    as 16-bit samples into one file fname (a .npy file). The offset and length of each
+    sequence go into fname+".index.npz", together with the audio configuration.
+    Returns the bank, opened (see StimulusBank).
+    """
+    if task is None:
+        task = EhrleSamson(playback="file",cache=None)
+
+    maxframes = task.SILENCE_LENGTH
+    if max_dev is not None:
+        maxframes = min(maxframes,task.deviation_frames(max_dev))
+
+    lengths = np.array([ task.onsets(f)[1] for f in range(maxframes+1) ])
+    offsets = np.concatenate([[0],np.cumsum(lengths)[:-1]])
+
+    bank = np.lib.format.open_memmap(fname,mode='w+',dtype=np.int16,shape=(int(lengths.sum()),))
+    scratch = np.empty(lengths.max())
+    for f in range(maxframes+1):
+        onsets,length = task.onsets(f)
+        values = task.synth.render(onsets,length,out=scratch[:length])
+        to_pcm(values,bank[offsets[f]:offsets[f]+length])
+    bank.flush()
+    del bank
+
+    np.savez(fname+".index.npz",offsets=offsets,lengths=lengths,
+             config=np.array(task.config,dtype=float))
+    return StimulusBank(fname)
+
+
+
+
+# The stimulus banks we have opened, by file name, shared by all EhrleSamson objects
+_BANKS = {}
+
+
+
+
+class MixerPlayback:
+    """
+    Plays rendered sequences straight from memory through the pygame mixer
+    (or anything that looks like it, such as StubMixer), without writing a
+    wave file: the samples are converted into a 16-bit buffer (which is kept
+    and reused) and handed to the mixer as a Sound. Playing then waits for
+    exactly the duration of the sequence plus a margin.
+    """
+
+    def __init__(self, samplefreq, margin=.05, mixer=None, wait=None):
+
+        if mixer is None:
+            import pygame
+            mixer = pygame.mixer
+            wait  = wait or pygame.time.wait
+        self.mixer = mixer
+        self.wait  = wait or (lambda ms: time.sleep(ms/1000.))
+
+        self.samplefreq = samplefreq
+        self.margin     = margin # in seconds
+
+        # We hand over mono 16-bit samples, so the mixer needs to expect exactly that
+        settings = (samplefreq,-16,1)
+        if mixer.get_init()!=settings:
+            if mixer.get_init():
+                mixer.quit()
+            mixer.init(frequency=settings[0],size=settings[1],channels=settings[2])
+
+        self.pcm = np.empty(0,dtype=np.int16)
+
+
+
+    def play(self, values):
+        """ Play the given samples (floats between -1 and 1, or 16-bit samples
+        which are used as they are) and wait until they are done. """
+        n = len(values)
+        if values.dtype==np.int16:
+            pcm = values
+        else:
+            if len(self.pcm)<n:
+                self.pcm = np.empty(n,dtype=np.int16)
+            pcm = to_pcm(values,self.pcm[:n])
+
+        sound = self.mixer.Sound(buffer=pcm)
+        sound.play()
+        self.wait( int(round((n/self.samplefreq+self.margin)*1000)) )
+        return sound
+
+
+
+
+class StubMixer:
+    """
+    Stands in for pygame.mixer when there is no audio device (for instance when
+    testing headless). It plays nothing, but keeps the samples of every sound
+    that was played in the list played.
+    """
+
+    def __init__(self):
+        self.settings = None
+        self.played   = []
+
+    def get_init(self):
+        return self.settings
+
+    def init(self, frequency, size, channels):
+        self.settings = (frequency,size,channels)
+
+    def quit(self):
+        self.settings = None
+
+    def Sound(self, buffer):
+        mixer = self
+        samples = np.frombuffer(buffer,dtype=np.int16).copy()
+        class Sound:
+            def play(self):
+                mixer.played.append(samples)
+            def get_length(self):
+                return len(samples)/mixer.settings[0]
+        return Sound()
+
+
+
+
 # Platform-specific imports
 if platform.system()=="Linux":
     import pygame
@@ -76,54 +365,120 @@ class EhrleSamson:
 
 
 
-    def __init__(self):
+    def __init__(self, reuse_buffer=False, playback="memory", margin=.05, mixer=None, wait=None,
+                 cache=RENDER_CACHE, bank=None):
+
+        # Everything that determines how a sequence sounds
+        self.config = (self.SAMPLEFREQ,self.C6FREQ,self.MAX_AMPLITUDE,
+                       self.DURATION,self.FADE_LENGTH,self.SILENCE_LENGTH)
 
-        # Generating a sine tone of 100ms long, C6
-        self.tone = sine_wave(self.C6FREQ,
-                              self.SAMPLEFREQ,
-                              self.MAX_AMPLITUDE,
-                              self.DURATION)
+        if self.config not in _TONES:
+            # Generating a sine tone of 100ms long, C6
+            tone = sine_wave(self.C6FREQ,
+                             self.SAMPLEFREQ,
+                             self.MAX_AMPLITUDE,
+                             self.DURATION)
         
-        # Now we generate a "fade-in" and "fade-out", just linear to keep it simple
-        for i in range(self.FADE_LENGTH):
-            self.tone[i] =  self.tone[i]*i/self.FADE_LENGTH
-        for i in range(self.FADE_LENGTH):
-            self.tone[-i] = self.tone[-i]*i/self.FADE_LENGTH
+            # Now we generate a "fade-in" and "fade-out", just linear to keep it simple
+            tone = linear_fade(tone,self.FADE_LENGTH)
 
-        # Generating silence
-        self.silence = [ 0 for _ in range(self.SILENCE_LENGTH) ]
+            # Put them in line, these are the first three tones
+            preface = ToneSequenceSynth(tone).render(self.onsets(0)[0][:3],3*(self.DURATION+self.SILENCE_LENGTH))
+
+            tone.flags.writeable = preface.flags.writeable = False
+            _TONES[self.config] = (tone,preface)
+        (self.tone,self.preface) = _TONES[self.config]
 
-        # Put them in line, these are the first three tones
-        self.preface = np.concatenate([self.tone,self.silence]*3)
+        # The sequences are rendered by writing the tone into a buffer at the right places
+        # (with reuse_buffer, the same buffer every time, so each sequence is only valid until the next)
+        self.synth = ToneSequenceSynth(self.tone,reuse=reuse_buffer)
+
+        # Rendered sequences are kept in this cache (None means we render every time)
+        self.cache = cache
+
+        # Optionally, a stimulus bank (or its file name) from which we play the sequences it has
+        if isinstance(bank,str):
+            if bank not in _BANKS:
+                _BANKS[bank] = StimulusBank(bank)
+            bank = _BANKS[bank]
+        if bank is not None and bank.config!=self.config:
+            raise ValueError("The stimulus bank {} was made with different audio settings".format(bank.fname))
+        self.bank = bank
+
+        # Generating silence
+        self.silence = np.zeros(self.SILENCE_LENGTH)
 
         if platform.system()=="Linux":
             # Initialise pygame for playing audio
             pygame.init()
 
+        # How to play the stimuli: "memory" hands the samples straight to the mixer
+        # (on Linux, or wherever a mixer such as StubMixer is given), while "file"
+        # writes a wave file first and plays that, as we used to.
+        # After playing from memory, we wait for the sequence to end plus margin seconds.
+        self.playback = playback
+        self.player   = None
+        if playback=="memory" and (mixer is not None or platform.system()=="Linux"):
+            self.player = MixerPlayback(self.SAMPLEFREQ,margin=margin,mixer=mixer,wait=wait)
+
+
+
+
+
+
 
+    def deviation_frames( self, dev ):
+        """ The number of samples by which the fourth tone is delayed for a deviation dev (in msec). """
+        return int(self.SAMPLEFREQ*max(dev,0.)/1000.)
 
 
 
+    def onsets( self, extrasilentframes ):
+        """ The onsets (in samples) of the five tones, when the fourth is delayed
+        by extrasilentframes, and the length of the whole sequence. """
+        period = self.DURATION+self.SILENCE_LENGTH
+        fourth = 3*period+extrasilentframes
+        # (the silence after the fourth tone becomes shorter, but not below zero)
+        fifth  = fourth+self.DURATION+max(0,self.SILENCE_LENGTH-extrasilentframes)
+        return [0,period,2*period,fourth,fifth],fifth+self.DURATION
 
 
-    def generate_hyde_peretz( self, dev ):
+
+    def generate_hyde_peretz( self, dev, out=None ):
         """ Generate the Hyde-Peretz (2004 Psych Sci) four-tone sequence,
         where the fourth is displaced, possibly, by an amount of dev (in msec).
-        Dev needs to be bigger than zero. """
+        Dev needs to be bigger than zero. The sequence is rendered into out if given
+        (see ToneSequenceSynth.render). Otherwise, if we have a cache, the sequence
+        comes from there (and is read-only). """
 
         if dev<0: 
             #print "Warning! Cannot generate the Hyde&Peretz for dev<0 (dev=%f)"%dev
             dev = 0.
 
         # The extra silence
-        extrasilentframes = int(self.SAMPLEFREQ*dev/1000.)
-        devsilence   = [ 0 for _ in range(extrasilentframes) ] # the silence that becomes longer
-        shortsilence = [ 0 for _ in range(self.SILENCE_LENGTH-extrasilentframes) ] # the silence that becomes shorter
+        extrasilentframes = self.deviation_frames(dev)
+
+        # Deviations that come down to the same number of samples sound the same
+        if out is None and self.cache is not None:
+            key = self.config+(extrasilentframes,)
+            values = self.cache.get(key)
+            if values is None:
+                onsets,length = self.onsets(extrasilentframes)
+                values = self.synth.render(onsets,length,out=np.empty(length))
+                self.cache.put(key,values)
+            return values
 
         # And then perhaps some alteration
-        values = np.concatenate([self.preface,devsilence,self.tone,shortsilence,self.tone])
+        onsets,length = self.onsets(extrasilentframes)
+        return self.synth.render(onsets,length,out=out)
+
 
-        return values
+
+    def prewarm( self, devs ):
+        """ Render the sequences for these deviations (in msec) into the cache
+        ahead of time, for instance for the catch trials and the demonstrations. """
+        for dev in devs:
+            self.generate_hyde_peretz(dev)
 
 
 
@@ -148,8 +503,33 @@ class EhrleSamson:
 
 
 
-    def playstim(self,stim):
-        """Play the given stimulus"""
+    def render(self, stim):
+        """ Return the samples that playstim would play for this stimulus: a slice
+        of the stimulus bank if it is in there, or else the rendered sequence.
+        Unlike generate_hyde_peretz, this never hands out the synth's reused buffer,
+        so it can be called from another thread (e.g. by a pythonmlp.Speculator
+        while the current sequence plays). """
+        if self.bank is not None:
+            values = self.bank.get(self.deviation_frames(stim))
+            if values is not None:
+                return values
+        if self.cache is None:
+            length = self.onsets(self.deviation_frames(stim))[1]
+            return self.generate_hyde_peretz(stim,out=np.empty(length))
+        return self.generate_hyde_peretz(stim)
+
+
+
+    def playstim(self,stim,values=None):
+        """Play the given stimulus (if it was already rendered, see render(), pass its samples as values)"""
+
+        if self.player is not None:
+            if values is None and self.bank is not None:
+                values = self.bank.get(self.deviation_frames(stim))
+            if values is None:
+                values = self.generate_hyde_peretz(stim)
+            self.player.play(values)
+            return
 
         # Make the wave file
         # Generate the temporary wave file for this stimulus
@@ -67,3 +67,23 @@ mlp.print()
 
 m = mlp.get_midpoint_estimate()
 print("Midpoint estimate : {}  vs. ground truth : {}".format(m,TRUTH_M))
+
+
+
+# Now let's do the same for a whole ensemble of simulated observers at once,
+# to see how biased and variable the estimate is
+from pythonmlp.simulate import simulate
+
+sim = simulate(
+    n_runs = 2000,
+    n_trials = 50,
+    truth_a = TRUTH_A,
+    truth_m = TRUTH_M,
+    truth_s = TRUTH_S,
+    slope = TRUTH_S,
+    hyp_min = 0,
+    hyp_max = MAXSTIM,
+    hyp_n = 200,
+    fa = [0.,.1,.2,.3,.4],
+)
+print("Over {} runs : bias {:.3f}, SD {:.3f}".format(len(sim.estimates),sim.bias(),sim.sd()))